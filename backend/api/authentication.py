@@ -0,0 +1,107 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework.authentication import TokenAuthentication
+
+
+class TokenUserCache:
+    """
+    Cache of users by authentication token. Users are kept in in-process LRU
+    for `TOKEN_CACHE_LOCAL_TIMEOUT` and in `TOKEN_CACHE_ALIAS` cache for
+    `TOKEN_CACHE_TIMEOUT`. Entries are removed in this process and in
+    `TOKEN_CACHE_ALIAS` cache, when token is deleted or user is changed,
+    other processes drop their local entries after local timeout. Cache,
+    which is not shared by processes (locmem), keeps entries for local
+    timeout only, as it can't be invalidated by other processes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            # users, which are being loaded from older data, are not kept
+            self.generation += 1
+            self.users = OrderedDict()
+
+    @property
+    def cache(self):
+        return caches[settings.TOKEN_CACHE_ALIAS]
+
+    @property
+    def timeout(self) -> int:
+        if isinstance(self.cache, LocMemCache):
+            return settings.TOKEN_CACHE_LOCAL_TIMEOUT
+        return settings.TOKEN_CACHE_TIMEOUT
+
+    @staticmethod
+    def get_cache_key(key: str) -> str:
+        return f'token:{key}'
+
+    def get(self, key: str):
+        """Returns copy of user with given token, None if it is not cached."""
+        with self._lock:
+            user, expires = self.users.get(key, (None, 0))
+            if user is not None and time.monotonic() < expires:
+                self.users.move_to_end(key)
+                return copy.copy(user)
+            generation = self.generation
+        user = self.cache.get(self.get_cache_key(key))
+        if user is None:
+            return None
+        self.set_local(key, user, generation)
+        return copy.copy(user)
+
+    def set(self, key: str, user, generation: int) -> None:
+        """Caches user with given token, unless cache was changed after
+        `generation`, i.e. user may be loaded from outdated data."""
+        if generation != self.generation:
+            return
+        self.cache.set(self.get_cache_key(key), user, self.timeout)
+        self.set_local(key, user, generation)
+
+    def set_local(self, key: str, user, generation: int) -> None:
+        with self._lock:
+            if generation != self.generation:
+                return
+            self.users[key] = (
+                user, time.monotonic() + settings.TOKEN_CACHE_LOCAL_TIMEOUT
+            )
+            self.users.move_to_end(key)
+            while len(self.users) > settings.TOKEN_CACHE_SIZE:
+                self.users.popitem(last=False)
+
+    def delete(self, keys) -> None:
+        """Removes users with given tokens from cache."""
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                self.users.pop(key, None)
+        self.cache.delete_many([self.get_cache_key(key) for key in keys])
+
+
+token_user_cache = TokenUserCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication, which takes users from `token_user_cache`, so
+    authenticated requests don't query token and user on every call.
+    """
+
+    def authenticate_credentials(self, key):
+        user = token_user_cache.get(key)
+        if user is not None:
+            return user, self.get_model()(key=key, user=user)
+        generation = token_user_cache.generation
+        # invalid tokens and inactive users are rejected and not cached
+        user, token = super().authenticate_credentials(key)
+        token_user_cache.set(key, user, generation)
+        return user, token
@@ -0,0 +1,113 @@
+import bisect
+
+from django.conf import settings
+
+from recipes.models import Ingredient
+from api.snapshots import SnapshotCache
+
+
+def get_trigrams(text: str) -> set:
+    """Returns trigrams of padded text, as pg_trgm does for a single word."""
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class IngredientIndexSnapshot:
+    """
+    Immutable search structures over all ingredients: names sorted for
+    prefix search by bisection and trigram postings for substring and
+    typo-tolerant search.
+    """
+
+    def __init__(self, ingredients) -> None:
+        # entries are sorted by name, so every result group keeps this order
+        self.entries = sorted(
+            (
+                {
+                    'id': ingredient['id'],
+                    'name': ingredient['name'],
+                    'measurement_unit': ingredient['measurement_unit']
+                }
+                for ingredient in ingredients
+            ),
+            key=lambda entry: (entry['name'].casefold(), entry['id'])
+        )
+        self.names = [entry['name'].casefold() for entry in self.entries]
+        self.trigrams = {}
+        for position, name in enumerate(self.names):
+            for trigram in get_trigrams(name):
+                self.trigrams.setdefault(trigram, set()).add(position)
+
+    def find_prefix(self, query: str) -> list:
+        start = bisect.bisect_left(self.names, query)
+        end = start
+        while end < len(self.names) and self.names[end].startswith(query):
+            end += 1
+        return list(range(start, end))
+
+    def find_substring(self, query: str) -> list:
+        if len(query) < 3:
+            candidates = range(len(self.names))
+        else:
+            postings = [
+                self.trigrams.get(query[i:i + 3], set())
+                for i in range(len(query) - 2)
+            ]
+            candidates = sorted(set.intersection(*postings))
+        return [
+            position for position in candidates
+            if query in self.names[position]
+            and not self.names[position].startswith(query)
+        ]
+
+    def find_similar(self, query: str, exclude: set) -> list:
+        trigrams = get_trigrams(query)
+        shared = {}
+        for trigram in trigrams:
+            for position in self.trigrams.get(trigram, ()):
+                shared[position] = shared.get(position, 0) + 1
+        similarity = {
+            position: count / len(
+                trigrams | get_trigrams(self.names[position])
+            )
+            for position, count in shared.items() if position not in exclude
+        }
+        return sorted(
+            (
+                position for position, value in similarity.items()
+                if value >= settings.INGREDIENT_INDEX_SIMILARITY
+            ),
+            key=lambda position: (-similarity[position], position)
+        )
+
+    def search(self, query: str, limit=None, fuzzy=False) -> list:
+        query = query.casefold()
+        positions = self.find_prefix(query)
+        if limit is None or len(positions) < limit:
+            positions += self.find_substring(query)
+        if fuzzy and (limit is None or len(positions) < limit):
+            positions += self.find_similar(query, set(positions))
+        return [self.entries[position] for position in positions[:limit]]
+
+
+class IngredientIndex(SnapshotCache):
+    """
+    In-process ingredient autocomplete index. Prefix matches go first, then
+    substring matches and, optionally, names similar to the query. Index is
+    rebuilt on first search after ingredients change (see SnapshotCache).
+    """
+    stamp_key = 'snapshot_stamp:ingredient_index'
+    timeout_setting = 'INGREDIENT_INDEX_TIMEOUT'
+
+    def build(self) -> IngredientIndexSnapshot:
+        return IngredientIndexSnapshot(
+            Ingredient.objects.values(
+                'id', 'name', 'measurement_unit'
+            ).iterator()
+        )
+
+    def search(self, query: str, limit=None, fuzzy=False) -> list:
+        return self.get_snapshot().search(query, limit=limit, fuzzy=fuzzy)
+
+
+ingredient_index = IngredientIndex()
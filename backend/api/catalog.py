@@ -0,0 +1,46 @@
+import gzip
+import hashlib
+import json
+
+from recipes.models import Ingredient, Tag
+from api.serializers import IngredientSerializer, TagSerializer
+from api.snapshots import SnapshotCache
+
+
+class CatalogBundleSnapshot:
+    """
+    Serialized ingredients and tags, compressed once. Version is a hash of
+    the content, so the same catalog always gets the same version.
+    """
+
+    def __init__(self, data: dict) -> None:
+        self.body = json.dumps(
+            data, ensure_ascii=False, separators=(',', ':')
+        ).encode()
+        self.gzip_body = gzip.compress(self.body, mtime=0)
+        self.version = hashlib.sha256(self.body).hexdigest()[:16]
+
+    def get_etag(self, encoding=None) -> str:
+        if encoding:
+            return f'"{self.version}-{encoding}"'
+        return f'"{self.version}"'
+
+
+class CatalogBundle(SnapshotCache):
+    """
+    In-process catalog bundle. It is rebuilt on first request after
+    ingredients or tags change (see SnapshotCache).
+    """
+    stamp_key = 'snapshot_stamp:catalog_bundle'
+    timeout_setting = 'CATALOG_BUNDLE_TIMEOUT'
+
+    def build(self) -> CatalogBundleSnapshot:
+        return CatalogBundleSnapshot({
+            'ingredients': IngredientSerializer(
+                Ingredient.objects.order_by('pk'), many=True
+            ).data,
+            'tags': TagSerializer(Tag.objects.order_by('pk'), many=True).data
+        })
+
+
+catalog_bundle = CatalogBundle()
@@ -0,0 +1,20 @@
+from rest_framework import exceptions, status
+
+
+class ServiceUnavailable(exceptions.APIException):
+    """Service is temporarily overloaded. `wait` is sent to client as
+    `Retry-After` header."""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Сервис временно перегружен, повторите запрос позже.'
+    default_code = 'service_unavailable'
+
+    def __init__(self, detail=None, code=None, wait=None):
+        super().__init__(detail, code)
+        self.wait = wait
+
+
+class RenderFailed(exceptions.APIException):
+    """Document could not be rendered."""
+    status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+    default_detail = 'Произошла ошибка формирования PDF-файла.'
+    default_code = 'render_failed'
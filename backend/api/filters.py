@@ -1,26 +1,142 @@
+import time
+
 import django_filters
+from django import forms
+from django.conf import settings
+from django.db.models import Exists, IntegerField, OuterRef, Q, Value
+from django_filters.widgets import QueryArrayWidget
+
+from recipes.models import Favorite, Recipe, ShoppingList, Tag
+from recipes.search import search_recipes
+
+
+class TagSlugsCache:
+    """
+    In-process cache of tag ids by slug. Tags are changed rarely, so all of
+    them are loaded at once and reloaded after `TAG_SLUGS_CACHE_TIMEOUT` or
+    when an unknown slug is requested.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.ids = {}
+        self.expires = 0
+
+    def get_ids(self, slugs) -> dict:
+        """Returns ids of tags with given slugs, e.g. {<slug>: <id>}."""
+        unknown = not self.ids.keys() >= set(slugs)
+        if unknown or time.monotonic() > self.expires:
+            self.ids = dict(Tag.objects.values_list('slug', 'pk'))
+            self.expires = time.monotonic() + settings.TAG_SLUGS_CACHE_TIMEOUT
+        return {slug: self.ids[slug] for slug in slugs if slug in self.ids}
+
+
+tag_slugs_cache = TagSlugsCache()
+
+
+class TagSlugsField(forms.Field):
+    """Multiple tag slugs field, cleaned value is a list of tag ids."""
+
+    widget = QueryArrayWidget
 
-from recipes.models import Recipe, Tag
-from django.db.models import Value, IntegerField, Q
+    def clean(self, value):
+        value = super().clean(value)
+        if not value:
+            return []
+        ids = tag_slugs_cache.get_ids(value)
+        unknown = [slug for slug in value if slug not in ids]
+        if unknown:
+            raise forms.ValidationError(
+                f'Теги не найдены: {", ".join(sorted(unknown))}.'
+            )
+        return list(ids.values())
+
+
+class TagsFilter(django_filters.Filter):
+    field_class = TagSlugsField
+
+
+# every ordering ends with `-pk`, so pages are stable; matching composite
+# indexes are declared in Recipe.Meta
+RECIPE_ORDERINGS = {
+    'popular': ('-favorites_count', '-pk'),
+    'cooking_time': ('cooking_time', '-pk'),
+    'newest': ('-pk', ),
+}
 
 
 class RecipeFilter(django_filters.FilterSet):
     """Custom filter for RecipeViewSet."""
 
-    tags = django_filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all()
+    tags = TagsFilter(method='filter_tags')
+    tags_match = django_filters.ChoiceFilter(
+        choices=(
+            ('any', 'Любой из тегов'),
+            ('all', 'Все теги'),
+        ),
+        method='filter_tags_match'
+    )
+    is_favorited = django_filters.NumberFilter(
+        method='filter_user_recipes'
     )
-    is_favorited = django_filters.NumberFilter(field_name='is_favorited')
     is_in_shopping_cart = django_filters.NumberFilter(
-        field_name='is_in_shopping_cart'
+        method='filter_user_recipes'
+    )
+    search = django_filters.CharFilter(method='filter_search')
+    ordering = django_filters.ChoiceFilter(
+        choices=(
+            ('popular', 'По популярности'),
+            ('cooking_time', 'По времени приготовления'),
+            ('newest', 'Сначала новые'),
+        ),
+        method='filter_ordering'
     )
 
     class Meta:
         model = Recipe
         fields = ['tags', 'author', 'is_favorited', 'is_in_shopping_cart']
 
+    def filter_user_recipes(self, queryset, name, value):
+        # recipes are selected from request user's entries by (user, recipe)
+        # unique index instead of checking every recipe
+        if self.request is None or self.request.user.is_anonymous:
+            return queryset.none() if value else queryset
+        model_class = {
+            'is_favorited': Favorite,
+            'is_in_shopping_cart': ShoppingList
+        }[name]
+        recipes = model_class.objects.filter(
+            user=self.request.user
+        ).values('recipe')
+        if value:
+            return queryset.filter(pk__in=recipes)
+        return queryset.exclude(pk__in=recipes)
+
+    def filter_tags(self, queryset, name, value):
+        # tags are looked up in recipe-tag table by (recipe, tag) unique
+        # index, without joins, which could duplicate recipes
+        recipe_tags = Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk')
+        )
+        if self.form.cleaned_data.get('tags_match') == 'all':
+            for tag in value:
+                queryset = queryset.filter(Exists(recipe_tags.filter(tag=tag)))
+            return queryset
+        return queryset.filter(Exists(recipe_tags.filter(tag__in=value)))
+
+    def filter_tags_match(self, queryset, name, value):
+        # semantics of `tags` filter, applied in `filter_tags`
+        return queryset
+
+    def filter_search(self, queryset, name, value):
+        # results are ordered by relevance, unless `ordering` is given
+        return search_recipes(queryset, value)
+
+    def filter_ordering(self, queryset, name, value):
+        return queryset.order_by(*RECIPE_ORDERINGS[value])
+
 
 class IngredientFilter(django_filters.FilterSet):
     """Custom filter for IngredientViewSet."""
@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db.models import (BooleanField, Prefetch, Value,
+                              prefetch_related_objects)
+
+from recipes.models import RecipeIngredients
+from api.catalog import catalog_bundle
+from api.serializers import RecipeSerializer
+
+
+User = get_user_model()
+
+
+def get_fragment_keys(recipes, request) -> dict:
+    """
+    Returns cache keys of recipes fragments. Key changes with recipe
+    version, author, catalog of ingredients and tags and host, which image
+    urls are built with.
+    """
+    prefix = (
+        f'recipe:{catalog_bundle.get_snapshot().version}:'
+        f'{request.build_absolute_uri("/")}'
+    )
+    return {
+        recipe.pk: f'{prefix}:{recipe.pk}:{recipe.cache_version}:'
+                   f'{recipe.author_id}'
+        for recipe in recipes
+    }
+
+
+def build_fragments(recipes, request) -> list:
+    """Serializes recipes without viewer-specific data."""
+    prefetch_related_objects(
+        recipes,
+        Prefetch(
+            'author',
+            queryset=User.objects.annotate(
+                is_subscribed=Value(False, output_field=BooleanField())
+            )
+        ),
+        'tags',
+        Prefetch(
+            'recipe_ingredients',
+            queryset=RecipeIngredients.objects.select_related('ingredient')
+        )
+    )
+    return RecipeSerializer(
+        recipes, many=True, context={'request': request}
+    ).data
+
+
+def serialize_recipes(recipes, request) -> list:
+    """
+    Returns the same data as RecipeSerializer. Data, which is the same for
+    every viewer, is cached per recipe, viewer flags are taken from
+    `is_favorited`, `is_in_shopping_cart` and `is_author_subscribed`
+    annotations of recipes.
+    """
+    cache = caches[settings.RECIPE_CACHE_ALIAS]
+    keys = get_fragment_keys(recipes, request)
+    fragments = cache.get_many(keys.values())
+    missing = [
+        recipe for recipe in recipes if keys[recipe.pk] not in fragments
+    ]
+    if missing:
+        built = {
+            keys[recipe.pk]: data
+            for recipe, data in zip(missing, build_fragments(missing, request))
+        }
+        cache.set_many(built, settings.RECIPE_CACHE_TIMEOUT)
+        fragments.update(built)
+    result = []
+    for recipe in recipes:
+        fragment = fragments[keys[recipe.pk]]
+        result.append({
+            **fragment,
+            'author': {
+                **fragment['author'],
+                'is_subscribed': getattr(
+                    recipe, 'is_author_subscribed', False
+                )
+            },
+            'is_favorited': getattr(recipe, 'is_favorited', False),
+            'is_in_shopping_cart': getattr(
+                recipe, 'is_in_shopping_cart', False
+            )
+        })
+    return result
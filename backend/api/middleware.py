@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.contrib.auth import middleware as auth_middleware
+from django.contrib.messages import middleware as messages_middleware
+from django.contrib.sessions import middleware as sessions_middleware
+from django.middleware import csrf
+
+
+def is_api_request(request) -> bool:
+    """Whether request is made to API, which authenticates by tokens and
+    doesn't use sessions, CSRF protection and messages."""
+    return request.path_info.startswith(settings.API_URL_PREFIX)
+
+
+class SkipApiRequestsMixin:
+    """
+    Middleware mixin, which passes API requests straight to the next
+    middleware. Admin and other views get the full middleware stack.
+    """
+
+    def __call__(self, request):
+        if is_api_request(request):
+            return self.get_response(request)
+        return super().__call__(request)
+
+
+class SessionMiddleware(SkipApiRequestsMixin,
+                        sessions_middleware.SessionMiddleware):
+    pass
+
+
+class CsrfViewMiddleware(SkipApiRequestsMixin, csrf.CsrfViewMiddleware):
+
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        if is_api_request(request):
+            return None
+        return super().process_view(
+            request, callback, callback_args, callback_kwargs
+        )
+
+
+class AuthenticationMiddleware(SkipApiRequestsMixin,
+                               auth_middleware.AuthenticationMiddleware):
+    pass
+
+
+class MessageMiddleware(SkipApiRequestsMixin,
+                        messages_middleware.MessageMiddleware):
+    pass
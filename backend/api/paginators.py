@@ -1,8 +1,134 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class ModifiedCursorPagination(CursorPagination):
+    """
+    CursorPagination with custom `page size` query param name. Ordering is
+    taken from queryset (or model Meta), so the same paginator can be used
+    for any view. Cursor keeps values of all ordering fields, ordering ends
+    with primary key, so position is unique and pages are selected by
+    keyset, even if leading ordering field has repeated values.
+    """
+    page_size_query_param = 'limit'
+    page_size = 6
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        ordering = tuple(
+            queryset.query.order_by or queryset.model._meta.ordering or ['pk']
+        )
+        pk_names = ('pk', queryset.model._meta.pk.name)
+        if ordering[-1].lstrip('-') not in pk_names:
+            ordering += ('pk', )
+        return ordering
+
+    @staticmethod
+    def reverse_ordering(ordering: tuple) -> tuple:
+        return tuple(
+            field[1:] if field.startswith('-') else f'-{field}'
+            for field in ordering
+        )
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = [
+            instance[field.lstrip('-')] if isinstance(instance, dict)
+            else getattr(instance, field.lstrip('-'))
+            for field in ordering
+        ]
+        return json.dumps(values, default=str)
+
+    def get_position_filter(self, ordering: tuple, position: str) -> Q:
+        """Returns filter of items following position in given ordering:
+        (a > x) OR (a = x AND b > y) OR ..."""
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        position_filter = Q()
+        equal = Q()
+        for field, value in zip(ordering, values):
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            field = field.lstrip('-')
+            position_filter |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        return position_filter
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            offset, reverse, current_position = 0, False, None
+        else:
+            offset, reverse, current_position = self.cursor
+
+        ordering = (
+            self.reverse_ordering(self.ordering) if reverse else self.ordering
+        )
+        queryset = queryset.order_by(*ordering)
+        if current_position is not None:
+            queryset = queryset.filter(
+                self.get_position_filter(ordering, current_position)
+            )
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        self.set_positions(results, reverse, current_position, offset)
+        if reverse:
+            self.page.reverse()
+        if self.has_previous or self.has_next:
+            self.display_page_controls = True
+        return self.page
+
+    def set_positions(self, results, reverse, current_position, offset):
+        """Sets next and previous positions, as CursorPagination does."""
+        following_position = None
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering
+            )
+        has_current = current_position is not None or offset > 0
+        has_following = following_position is not None
+        if reverse:
+            self.has_next, self.has_previous = has_current, has_following
+            self.next_position = current_position
+            self.previous_position = following_position
+        else:
+            self.has_next, self.has_previous = has_following, has_current
+            self.next_position = following_position
+            self.previous_position = current_position
 
 
 class ModifiedPageNumberPagination(PageNumberPagination):
-    """PageNumberPagination with custom `page size` query param name."""
+    """
+    PageNumberPagination with custom `page size` query param name.
+    If `cursor` query param is passed (empty for the first page), keyset
+    pagination is used instead: no total count and no OFFSET scans.
+    """
     page_size_query_param = 'limit'
     page_size = 6
     max_page_size = 100
+    cursor_query_param = 'cursor'
+    cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param in request.query_params:
+            self.cursor_paginator = ModifiedCursorPagination()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,102 @@
+"""
+PDF rendering functions, executed in a separate process pool.
+Module does not depend on Django, so it can be imported by pool workers
+regardless of the multiprocessing start method.
+"""
+import os
+
+from functools import partial
+from io import BytesIO
+from pathlib import Path
+from typing import Iterable, Tuple
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from xhtml2pdf import pisa
+
+
+FONT_NAME = 'FreeSans'
+FONT_PATH = (
+    Path(__file__).resolve().parent.parent / 'static' / 'fonts'
+    / 'FreeSans.ttf'
+)
+# Font is registered once per process, on module import
+pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_PATH))
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+MARGIN = 40
+LINE_HEIGHT = 18
+TITLE_FONT_SIZE = 16
+FONT_SIZE = 11
+# x positions of table columns: checkbox, name, measurement unit, amount
+COLUMNS = (MARGIN, MARGIN + 20, MARGIN + 300, MARGIN + 430)
+TABLE_HEADER = ('#', 'Ингредиент', 'Единица измерения', 'Количество')
+
+
+def link_callback(static_root: str, static_url: str, uri: str, rel: str):
+    """Convert HTML URI to absolute system path so xhtml2pdf can access
+    those resources."""
+    return os.path.join(static_root, uri.replace(static_url, ''))
+
+
+def html_to_pdf(html: str, static_root: str, static_url: str) -> bytes:
+    """Converts HTML to PDF. Returns None, if PDF could not be rendered."""
+    result = BytesIO()
+    pdf = pisa.pisaDocument(
+        BytesIO(html.encode('UTF-8')),
+        result,
+        link_callback=partial(link_callback, str(static_root), static_url)
+    )
+    if pdf.err:
+        return None
+    return result.getvalue()
+
+
+def fit_text(text: str, width: float) -> str:
+    """Truncates text, so it fits into given width."""
+    if pdfmetrics.stringWidth(text, FONT_NAME, FONT_SIZE) <= width:
+        return text
+    while text and pdfmetrics.stringWidth(
+        text + '…', FONT_NAME, FONT_SIZE
+    ) > width:
+        text = text[:-1]
+    return text + '…'
+
+
+def draw_table_row(pdf: canvas.Canvas, y: float, row: Tuple) -> None:
+    widths = [
+        right - left for left, right in zip(COLUMNS, COLUMNS[1:])
+    ] + [PAGE_WIDTH - MARGIN - COLUMNS[-1]]
+    for x, width, value in zip(COLUMNS, widths, row):
+        pdf.drawString(x, y, fit_text(str(value), width - 5))
+
+
+def rows_to_pdf(rows: Iterable[Tuple[str, str, int]]) -> bytes:
+    """
+    Draws shopping list table of (name, measurement_unit, amount) rows
+    straight onto PDF canvas and returns PDF content.
+    """
+    result = BytesIO()
+    pdf = canvas.Canvas(result, pagesize=A4)
+    pdf.setTitle('Список покупок')
+    pdf.setFont(FONT_NAME, TITLE_FONT_SIZE)
+    y = PAGE_HEIGHT - MARGIN - TITLE_FONT_SIZE
+    pdf.drawString(MARGIN, y, 'Список покупок')
+    y -= LINE_HEIGHT * 2
+    pdf.setFont(FONT_NAME, FONT_SIZE)
+    draw_table_row(pdf, y, TABLE_HEADER)
+    for name, measurement_unit, amount in rows:
+        y -= LINE_HEIGHT
+        if y < MARGIN:
+            pdf.showPage()
+            pdf.setFont(FONT_NAME, FONT_SIZE)
+            y = PAGE_HEIGHT - MARGIN - FONT_SIZE
+            draw_table_row(pdf, y, TABLE_HEADER)
+            y -= LINE_HEIGHT
+        draw_table_row(pdf, y, ('□', name, measurement_unit, amount))
+    y -= LINE_HEIGHT
+    pdf.line(MARGIN, y, PAGE_WIDTH - MARGIN, y)
+    pdf.save()
+    return result.getvalue()
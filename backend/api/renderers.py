@@ -0,0 +1,34 @@
+from rest_framework import renderers
+
+
+class ShoppingListRenderer(renderers.BaseRenderer):
+    """
+    Base renderer for shopping list export formats. Shopping list view
+    returns ready HttpResponse, so renderers are only used to select export
+    format with `format` query param or `Accept` header.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
+
+
+class PDFRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    render_style = 'binary'
+
+
+class PlainTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class CSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class JSONRenderer(ShoppingListRenderer):
+    media_type = 'application/json'
+    format = 'json'
@@ -1,15 +1,32 @@
 import base64
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.db.models import F, Prefetch, prefetch_related_objects
 from rest_framework import serializers
 
-from recipes.models import Tag, Ingredient, Recipe, RecipeIngredients
+from recipes.models import (Tag, Ingredient, Recipe, RecipeIngredients,
+                            ShoppingCartIngredient, change_recipes_count,
+                            update_shopping_carts)
 
 
 User = get_user_model()
 
 
+def get_subscribed_ids(request) -> frozenset:
+    """
+    Returns ids of users, that request user is subscribed to. Ids are loaded
+    once per request and shared by all serializers of the request.
+    """
+    if not hasattr(request, '_subscribed_ids'):
+        request._subscribed_ids = frozenset(
+            request.user.subscribed_to.values_list('pk', flat=True)
+        )
+    return request._subscribed_ids
+
+
 class UserSerializer(serializers.ModelSerializer):
     """Main user serializer, used for `users` endpoints."""
 
@@ -21,10 +38,12 @@ class UserSerializer(serializers.ModelSerializer):
                   'id', 'is_subscribed')
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
-        return obj in request.user.subscribed_to.all()
+        return obj.pk in get_subscribed_ids(request)
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -64,16 +83,31 @@ class RecipeIngredientsSerializer(serializers.ModelSerializer):
 class RecipeIngredientWriteSerializer(serializers.ModelSerializer):
     """
     Same as RecipeIngredient serializer, but used for creating and updating
-    Recipe objects.
+    Recipe objects. Ingredient ids of all items are resolved by
+    RecipeWriteSerializer with a single query.
     """
 
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
 
     class Meta:
         model = RecipeIngredients
         fields = ('id', 'amount')
 
 
+class ShoppingCartIngredientSerializer(serializers.ModelSerializer):
+    """Serializer for total amounts of ingredients in user's shopping cart."""
+
+    id = serializers.ReadOnlyField(source='ingredient.id')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit'
+    )
+
+    class Meta:
+        model = ShoppingCartIngredient
+        fields = ('id', 'name', 'measurement_unit', 'amount')
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     """Serializer for Recipe model. Represents `safe` methods."""
     is_favorited = serializers.BooleanField(default=False)
@@ -92,6 +126,21 @@ class RecipeSerializer(serializers.ModelSerializer):
                   'cooking_time')
 
 
+def get_does_not_exist_message(pk) -> str:
+    """Same message, as PrimaryKeyRelatedField returns for unknown pk."""
+    return serializers.PrimaryKeyRelatedField.default_error_messages[
+        'does_not_exist'
+    ].format(pk_value=pk)
+
+
+def sum_amounts(amounts) -> dict:
+    """Sums (ingredient_id, amount) pairs by ingredient."""
+    result = {}
+    for ingredient_id, amount in amounts:
+        result[ingredient_id] = result.get(ingredient_id, 0) + amount
+    return result
+
+
 class Base64ToImageField(serializers.ImageField):
     """Custom image field, that converts Base64 encoded string to image."""
 
@@ -129,12 +178,112 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
 
     image = Base64ToImageField()
     ingredients = RecipeIngredientWriteSerializer(many=True)
+    tags = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False
+    )
 
     class Meta:
         model = Recipe
         fields = ('ingredients', 'tags', 'image', 'name', 'text',
                   'cooking_time')
 
+    def validate_ingredients(self, value):
+        """Resolves ingredient ids with a single query. Unknown and
+        duplicated ingredients are reported per item."""
+        ingredients = Ingredient.objects.in_bulk(
+            {entry['id'] for entry in value}
+        )
+        errors = []
+        seen = set()
+        for entry in value:
+            error = {}
+            if entry['id'] not in ingredients:
+                error['id'] = [get_does_not_exist_message(entry['id'])]
+            elif entry['id'] in seen:
+                error['id'] = ['Ингредиент указан несколько раз.']
+            seen.add(entry['id'])
+            errors.append(error)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return [
+            {**entry, 'id': ingredients[entry['id']]} for entry in value
+        ]
+
+    def validate_tags(self, value):
+        """Resolves tag ids with a single query. Unknown tags are reported
+        per item."""
+        tags = Tag.objects.in_bulk(set(value))
+        errors = {
+            index: [get_does_not_exist_message(pk)]
+            for index, pk in enumerate(value) if pk not in tags
+        }
+        if errors:
+            raise serializers.ValidationError(errors)
+        return [tags[pk] for pk in dict.fromkeys(value)]
+
+    def set_ingredients(self, recipe, ingredient_list, created):
+        """
+        Writes recipe ingredients, changing only rows that differ from
+        already saved ones. Returns amounts of ingredients before and after
+        the change, e.g. {<ingredient_id>: <amount>}.
+        """
+        new_amounts = sum_amounts(
+            (ingredient['id'].pk, ingredient['amount'])
+            for ingredient in ingredient_list
+        )
+        saved = []
+        if not created:
+            saved = list(RecipeIngredients.objects.filter(recipe=recipe))
+        old_amounts = sum_amounts(
+            (entry.ingredient_id, entry.amount) for entry in saved
+        )
+        kept = set()
+        to_update = []
+        to_delete = []
+        for entry in saved:
+            if (entry.ingredient_id not in new_amounts
+                    or entry.ingredient_id in kept):
+                to_delete.append(entry.pk)
+                continue
+            kept.add(entry.ingredient_id)
+            if entry.amount != new_amounts[entry.ingredient_id]:
+                entry.amount = new_amounts[entry.ingredient_id]
+                to_update.append(entry)
+        if to_delete:
+            RecipeIngredients.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            RecipeIngredients.objects.bulk_update(to_update, ['amount'])
+        RecipeIngredients.objects.bulk_create(
+            RecipeIngredients(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount
+            )
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id not in kept
+        )
+        return old_amounts, new_amounts
+
+    def set_tags(self, recipe, tag_list, created):
+        """Writes recipe tags, changing only rows that differ from already
+        saved ones."""
+        tags = {tag.pk for tag in tag_list}
+        saved = set()
+        if not created:
+            saved = set(
+                Recipe.tags.through.objects.filter(recipe=recipe).values_list(
+                    'tag', flat=True
+                )
+            )
+        if saved - tags:
+            Recipe.tags.through.objects.filter(
+                recipe=recipe, tag__in=saved - tags
+            ).delete()
+        if tags - saved:
+            Recipe.tags.through.objects.bulk_create(
+                Recipe.tags.through(recipe=recipe, tag_id=tag)
+                for tag in tags - saved
+            )
+
+    @transaction.atomic
     def update_or_create_recipe(self, validated_data, instance=None):
         tag_list = validated_data.pop('tags', None)
         ingredient_list = validated_data.pop('ingredients', None)
@@ -142,20 +291,25 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 'Укажите как минимум один тег и ингредиент'
             )
-        if not instance:
+        created = instance is None
+        if created:
             instance = Recipe()
+        else:
+            # cached representations of the recipe are no longer used
+            instance.cache_version = F('cache_version') + 1
         for key, val in validated_data.items():
             setattr(instance, key, val)
         instance.save()
-        instance.ingredients.clear()
-        instance.tags.clear()
-        for ingredient in ingredient_list:
-            RecipeIngredients.objects.create(
-                recipe=instance,
-                ingredient=ingredient['id'],
-                amount=ingredient['amount']
+        if created:
+            change_recipes_count(instance.author, 1)
+        if ingredient_list is not None:
+            old_amounts, new_amounts = self.set_ingredients(
+                instance, ingredient_list, created
             )
-        instance.tags.set(tag_list)
+            if old_amounts != new_amounts and not created:
+                update_shopping_carts(instance, old_amounts, new_amounts)
+        if tag_list is not None:
+            self.set_tags(instance, tag_list, created)
         return instance
 
     def create(self, validated_data):
@@ -165,7 +319,17 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         return self.update_or_create_recipe(validated_data, instance=instance)
 
     def to_representation(self, instance):
-        serializer = RecipeSerializer(instance)
+        prefetch_related_objects(
+            [instance],
+            'tags',
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredients.objects.select_related(
+                    'ingredient'
+                )
+            )
+        )
+        serializer = RecipeSerializer(instance, context=self.context)
         return serializer.data
 
 
@@ -180,11 +344,20 @@ class ShortRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'image', 'name', 'cooking_time')
 
 
+class IdsSerializer(serializers.Serializer):
+    """Serializer for list of object ids. Used by bulk endpoints."""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_IDS_MAX_LENGTH
+    )
+
+
 class UserWithRecipesSerializer(UserSerializer):
     """Serializer for User model. Used to represent User subscriptions."""
 
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.IntegerField(source='recipes.count')
     is_subscribed = serializers.BooleanField(default=True)
 
     class Meta:
@@ -193,11 +366,8 @@ class UserWithRecipesSerializer(UserSerializer):
                   'id', 'is_subscribed', 'recipes', 'recipes_count')
 
     def get_recipes(self, obj):
-        recipes_limit = self.context.get('recipes_limit')
-        if recipes_limit:
-            try:
-                recipes_limit = int(recipes_limit)
-            except ValueError:
-                recipes_limit = None
-        recipes = obj.recipes.all()[:recipes_limit]
+        if hasattr(obj, 'limited_recipes'):
+            recipes = obj.limited_recipes
+        else:
+            recipes = obj.recipes.all()[:self.context.get('recipes_limit')]
         return ShortRecipeSerializer(recipes, many=True).data
@@ -1,88 +1,309 @@
+import csv
+import json
+import multiprocessing
 import os
+import threading
 
-from io import BytesIO
-from typing import List
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache, partial
 
-from django.http import HttpResponse
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
 from django.template.loader import get_template
-from django.db.models import QuerySet
+from django.db.models import F, QuerySet
 from django.contrib.auth import get_user_model
 from django.conf import settings
-from xhtml2pdf import pisa
+
+from recipes.models import ShoppingCartIngredient
+from api.exceptions import RenderFailed, ServiceUnavailable
+from api.pdf import html_to_pdf, rows_to_pdf
 
 
 UserModel = get_user_model()
 
 
+class RenderPool:
+    """
+    Bounded process pool for CPU-heavy rendering. At most `workers` jobs are
+    executed at once and at most `queue_size` jobs wait for a free worker,
+    further jobs are rejected with ServiceUnavailable instead of blocking
+    the request. Job result is awaited for no more than `timeout` seconds,
+    job keeps running after timeout, so its result can still be used.
+    """
+    def __init__(self, workers: int, queue_size: int, timeout: float) -> None:
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._jobs = {}
+
+    @staticmethod
+    def get_mp_context():
+        """
+        Returns multiprocessing context for workers. Web server workers run
+        several threads, so workers are not forked from them (locks held by
+        other threads would stay locked in children), but from a clean
+        forkserver process, which imports rendering functions once.
+        """
+        if 'forkserver' not in multiprocessing.get_all_start_methods():
+            return multiprocessing.get_context('spawn')
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['api.pdf'])
+        return context
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        """Returns executor, (re)creating it after fork or worker crash."""
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=self.get_mp_context()
+                )
+                self._pid = os.getpid()
+                self._jobs = {}
+            return self._executor
+
+    def reset(self) -> None:
+        with self._lock:
+            self._executor = None
+
+    def submit(self, func, args, key=None, on_result=None) -> Future:
+        """Submits job to the pool, or returns unfinished job with the same
+        `key`. `on_result` is called with result of finished job."""
+        executor = self.get_executor()
+        with self._lock:
+            if key is not None and key in self._jobs:
+                return self._jobs[key]
+            if not self._slots.acquire(blocking=False):
+                raise ServiceUnavailable(wait=self.timeout)
+            try:
+                future = executor.submit(func, *args)
+            except BrokenProcessPool:
+                self._slots.release()
+                self._executor = None
+                raise ServiceUnavailable(wait=self.timeout)
+            if key is not None:
+                self._jobs[key] = future
+        future.add_done_callback(
+            partial(self.finish, key=key, on_result=on_result)
+        )
+        return future
+
+    def finish(self, future: Future, key=None, on_result=None) -> None:
+        if on_result is not None and not future.cancelled() and (
+            future.exception() is None
+        ):
+            on_result(future.result())
+        with self._lock:
+            if self._jobs.get(key) is future:
+                del self._jobs[key]
+        self._slots.release()
+
+    def run(self, func, *args, key=None, on_result=None):
+        """
+        Runs func(*args) in the pool, returns its result. Jobs with the same
+        `key` are shared: unfinished job is awaited instead of starting a new
+        one, so retries after timeout don't occupy more workers. `on_result`
+        is called with job result, even if it is not awaited anymore.
+        """
+        future = self.submit(func, args, key=key, on_result=on_result)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise ServiceUnavailable(wait=self.timeout)
+        except BrokenProcessPool:
+            self.reset()
+            raise ServiceUnavailable(wait=self.timeout)
+
+
+@lru_cache(maxsize=None)
+def get_render_pool() -> RenderPool:
+    """Returns process-wide pool for shopping list rendering."""
+    return RenderPool(
+        workers=settings.SHOPPING_LIST_RENDER_WORKERS,
+        queue_size=settings.SHOPPING_LIST_RENDER_QUEUE_SIZE,
+        timeout=settings.SHOPPING_LIST_RENDER_TIMEOUT
+    )
+
+
+class Echo:
+    """Pseudo-buffer for csv.writer, returns written value instead of
+    storing it."""
+
+    def write(self, value):
+        return value
+
+
 class ShoppingListGenerator:
     """
     A class that creates a list of ingredients with amounts and
     measurement units from all recipes, that user marked as `in_shopping_cart`.
-    List can be converted to PDF and returned as HttpResponse.
+    List can be converted to PDF and returned as HttpResponse, or streamed
+    as plain text, CSV or JSON.
+    Rendered PDF is cached under user's shopping cart version, which changes
+    every time user's shopping list is modified.
     """
     def __init__(self, user: UserModel) -> None:
         self.user = user
+        self._cart_version = None
 
-    def get_list_of_all_ingredient_querysets(self) -> List[QuerySet]:
-        """
-        Returns list of querysets of all recipes ingredients
-        from user's shopping list.
-        """
-        ingredients = []
-        shopping_list = self.user.shoppinglist_recipes.all()
-        for entry in shopping_list:
-            ingredients.append(entry.recipe.recipe_ingredients.all())
-        return ingredients
-
-    def get_all_ingredients_with_amounts(
-        self, ingredients_list: List[QuerySet]
-    ) -> dict:
+    @property
+    def cart_version(self) -> int:
+        """Current version of user's shopping cart, read from database."""
+        if self._cart_version is None:
+            self._cart_version = UserModel.objects.filter(
+                pk=self.user.pk
+            ).values_list('shopping_cart_version', flat=True).get()
+        return self._cart_version
+
+    @property
+    def renderer(self) -> str:
+        return settings.SHOPPING_LIST_PDF_RENDERER
+
+    def get_etag(self) -> str:
+        """Returns ETag of user's shopping list for current cart version."""
+        return (
+            f'"shopping-list-{self.user.pk}-{self.cart_version}-'
+            f'{self.renderer}"'
+        )
+
+    def get_cache_key(self) -> str:
+        return (
+            f'shopping_list_pdf:{self.user.pk}:{self.cart_version}:'
+            f'{self.renderer}'
+        )
+
+    def get_ingredients(self) -> QuerySet:
         """
-        Gets list of ingredient querysets, returns dict of ingredients with
-        amounts and measurement units, e.g.:
-            {'salt': {'amount': 100,
-                      'measurement_unit': 'kg'}}
+        Returns ingredients of all recipes from user's shopping list with
+        summed amounts, e.g.:
+            [{'ingredient_id': 1, 'name': 'salt',
+              'measurement_unit': 'g', 'amount': 100}]
+        Amounts are read from ShoppingCartIngredient totals, which are kept
+        up to date on every shopping list change, grouped by ingredient,
+        so ingredients with the same name but different measurement units
+        are listed separately.
         """
-        output = {}
-        for queryset in ingredients_list:
-            for entry in queryset:
-                ingredient = entry.ingredient.name
-                if ingredient in output:
-                    output[ingredient]['amount'] += entry.amount
-                else:
-                    output[ingredient] = {
-                        'amount': entry.amount,
-                        'measurement_unit': entry.ingredient.measurement_unit
-                    }
-        return output
-
-    def link_callback(self, uri, rel):
-        """Convert HTML URI to absolute system path so xhtml2pdf can access those
-            resources."""
-        return os.path.join(
-            settings.STATIC_ROOT, uri.replace(settings.STATIC_URL, '')
+        return (
+            ShoppingCartIngredient.objects
+            .filter(user=self.user, amount__gt=0)
+            .values(
+                'ingredient_id',
+                'amount',
+                name=F('ingredient__name'),
+                measurement_unit=F('ingredient__measurement_unit')
+            )
+            .order_by('name', 'measurement_unit')
         )
 
     def render_pdf_from_html_template(
-        self, template_name: str = None, context: dict = None
-    ) -> HttpResponse:
-        """Render html template, converts it to PDF and returns as
-        HttpResponse."""
+        self, template_name: str = None, context: list = None
+    ) -> bytes:
+        """Render html template, converts it to PDF in the render pool and
+        returns its content. Returns None, if PDF could not be rendered."""
         if not template_name:
             template = get_template('shopping_list_template.html')
         else:
             template = get_template(template_name)
         html = template.render({'ingredients': context})
-        result = BytesIO()
-        pdf = pisa.pisaDocument(BytesIO(html.encode('UTF-8')),
-                                result,
-                                link_callback=self.link_callback)
-        if pdf.err:
-            return HttpResponse('Произошла ошибка формирования PDF-файла')
-        return HttpResponse(result.getvalue(), content_type='application/pdf')
+        return self.run_in_pool(
+            html_to_pdf, html, settings.STATIC_ROOT, settings.STATIC_URL
+        )
+
+    def render_pdf_with_reportlab(self, ingredients: list) -> bytes:
+        """Draws shopping list with ReportLab in the render pool, without
+        HTML template, and returns PDF content."""
+        rows = [
+            (entry['name'], entry['measurement_unit'], entry['amount'])
+            for entry in ingredients
+        ]
+        return self.run_in_pool(rows_to_pdf, rows)
+
+    def run_in_pool(self, func, *args) -> bytes:
+        """
+        Renders PDF in the render pool. Render is shared by requests for the
+        same cart version and rendered PDF is cached, even if request timed
+        out, so retry is served from cache.
+        """
+        return get_render_pool().run(
+            func, *args, key=self.get_cache_key(), on_result=self.cache_pdf
+        )
+
+    def cache_pdf(self, content: bytes) -> None:
+        if content is not None:
+            cache.set(
+                self.get_cache_key(), content,
+                settings.SHOPPING_LIST_CACHE_TIMEOUT
+            )
+
+    def render_pdf(self, ingredients: list) -> bytes:
+        """Renders PDF with renderer, selected in settings."""
+        if self.renderer == 'reportlab':
+            return self.render_pdf_with_reportlab(ingredients)
+        return self.render_pdf_from_html_template(context=ingredients)
 
     def generate_pdf(self) -> HttpResponse:
-        """Entry point to generate shopping list pdf."""
-        ingredient_list = self.get_list_of_all_ingredient_querysets()
-        context = self.get_all_ingredients_with_amounts(ingredient_list)
-        return self.render_pdf_from_html_template(context=context)
+        """Entry point to generate shopping list pdf. Raises RenderFailed,
+        if PDF could not be rendered."""
+        cache_key = self.get_cache_key()
+        content = cache.get(cache_key)
+        if content is None:
+            # rendered PDF is cached by render_pdf
+            content = self.render_pdf(self.get_ingredients())
+            if content is None:
+                raise RenderFailed()
+        return HttpResponse(content, content_type='application/pdf')
+
+    def iter_text(self, ingredients):
+        yield 'Список покупок\n\n'
+        for entry in ingredients:
+            yield (
+                f'□ {entry["name"]} ({entry["measurement_unit"]}) — '
+                f'{entry["amount"]}\n'
+            )
+
+    def iter_csv(self, ingredients):
+        writer = csv.writer(Echo())
+        yield writer.writerow(('name', 'measurement_unit', 'amount'))
+        for entry in ingredients:
+            yield writer.writerow(
+                (entry['name'], entry['measurement_unit'], entry['amount'])
+            )
+
+    def iter_json(self, ingredients):
+        yield '['
+        for index, entry in enumerate(ingredients):
+            yield (',' if index else '') + json.dumps(
+                {
+                    'id': entry['ingredient_id'],
+                    'name': entry['name'],
+                    'measurement_unit': entry['measurement_unit'],
+                    'amount': entry['amount']
+                },
+                ensure_ascii=False
+            )
+        yield ']'
+
+    def stream(self, export_format: str) -> StreamingHttpResponse:
+        """
+        Streams shopping list in given format (`txt`, `csv` or `json`).
+        Ingredients are read from database with iterator, so memory usage
+        does not depend on the size of the list.
+        """
+        content_type, iter_content = {
+            'txt': ('text/plain; charset=utf-8', self.iter_text),
+            'csv': ('text/csv; charset=utf-8', self.iter_csv),
+            'json': ('application/json', self.iter_json)
+        }[export_format]
+        response = StreamingHttpResponse(
+            iter_content(self.get_ingredients().iterator()),
+            content_type=content_type
+        )
+        if export_format != 'json':
+            response['Content-Disposition'] = (
+                f'attachment; filename="shopping_list.{export_format}"'
+            )
+        return response
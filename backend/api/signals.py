@@ -0,0 +1,51 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Tag
+from recipes.signals import catalog_changed
+from api.authentication import token_user_cache
+from api.autocomplete import ingredient_index
+from api.catalog import catalog_bundle
+from api.filters import tag_slugs_cache
+
+User = get_user_model()
+
+# caches are rebuilt from committed data only
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(catalog_changed, sender=Ingredient)
+def clear_ingredient_caches(sender, **kwargs):
+    transaction.on_commit(ingredient_index.changed)
+    transaction.on_commit(catalog_bundle.changed)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(catalog_changed, sender=Tag)
+def clear_tag_caches(sender, **kwargs):
+    transaction.on_commit(tag_slugs_cache.clear)
+    transaction.on_commit(catalog_bundle.changed)
+
+
+@receiver(post_save, sender=User)
+def clear_user_tokens(sender, instance, created, **kwargs):
+    # password, `is_active` and other changes of user are applied to
+    # authenticated requests at once
+    if created:
+        return
+    keys = list(
+        Token.objects.filter(user=instance.pk).values_list('key', flat=True)
+    )
+    if keys:
+        transaction.on_commit(lambda: token_user_cache.delete(keys))
+
+
+@receiver(post_delete, sender=Token)
+def clear_deleted_token(sender, instance, **kwargs):
+    # token is deleted on logout and with its user
+    transaction.on_commit(lambda: token_user_cache.delete([instance.key]))
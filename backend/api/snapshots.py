@@ -0,0 +1,107 @@
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+
+class SnapshotCache:
+    """
+    In-process cache of an immutable snapshot, which is built by `build()`.
+    Snapshot is rebuilt on first use after its rows change: `changed()`
+    replaces change stamp, which is kept under `stamp_key` in
+    `SNAPSHOT_STAMP_CACHE_ALIAS` cache, so every process notices the change.
+    Cache, which is not shared by processes (locmem), can't pass the stamp
+    to other processes, then snapshot is also rebuilt after timeout, which
+    is taken from `timeout_setting`. Subclasses define `build()`,
+    `stamp_key` and `timeout_setting`.
+    """
+    stamp_key = None
+    timeout_setting = None
+    # snapshot is refreshed on demand no more often than once in interval
+    # (in seconds), so requests for unknown data can't rebuild it each time
+    refresh_interval = 1
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.clear()
+
+    def clear(self):
+        # snapshot, which is being built from older data, is not kept
+        self.generation += 1
+        # snapshot, its change stamp, expiry and build time
+        self.entry = (None, None, 0, 0)
+
+    @property
+    def cache(self):
+        return caches[settings.SNAPSHOT_STAMP_CACHE_ALIAS]
+
+    def changed(self):
+        """Replaces change stamp, so snapshot is rebuilt in all processes."""
+        self.cache.set(self.stamp_key, uuid.uuid4().hex, None)
+        self.clear()
+
+    def get_stamp(self) -> str:
+        stamp = self.cache.get(self.stamp_key)
+        if stamp is not None:
+            return stamp
+        # stamp is missing or evicted, all processes take the same new one
+        self.cache.add(self.stamp_key, uuid.uuid4().hex, None)
+        return self.cache.get(self.stamp_key)
+
+    def get_fresh_snapshot(self, stamp: str):
+        """Returns snapshot built under given stamp, None if it is outdated."""
+        snapshot, snapshot_stamp, expires, _ = self.entry
+        if snapshot_stamp != stamp or (
+            isinstance(self.cache, LocMemCache)
+            and time.monotonic() >= expires
+        ):
+            return None
+        return snapshot
+
+    def build(self):
+        raise NotImplementedError
+
+    def build_snapshot(self, stamp: str):
+        """Builds snapshot and keeps it, must be called with lock held."""
+        generation = self.generation
+        snapshot = self.build()
+        if generation == self.generation:
+            now = time.monotonic()
+            self.entry = (
+                snapshot,
+                stamp,
+                now + getattr(settings, self.timeout_setting),
+                now
+            )
+        return snapshot
+
+    def get_snapshot(self):
+        stamp = self.get_stamp()
+        snapshot = self.get_fresh_snapshot(stamp)
+        if snapshot is not None:
+            return snapshot
+        with self._lock:
+            # snapshot could be built, while waiting for the lock
+            snapshot = self.get_fresh_snapshot(stamp)
+            if snapshot is not None:
+                return snapshot
+            return self.build_snapshot(stamp)
+
+    def refresh(self):
+        """
+        Rebuilds snapshot, unless it was built within `refresh_interval`,
+        returns it. Used, when data from a newer snapshot of another process
+        is requested, which this process has not noticed yet.
+        """
+        stamp = self.get_stamp()
+        with self._lock:
+            snapshot, _, _, built = self.entry
+            if snapshot is not None and (
+                time.monotonic() < built + self.refresh_interval
+            ):
+                return snapshot
+            return self.build_snapshot(stamp)
@@ -1,7 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from api.views import IngredientViewSet, TagViewSet, RecipeViewSet, UserViewSet
+from api.views import (IngredientViewSet, TagViewSet, RecipeViewSet,
+                       UserViewSet, catalog)
 
 
 router = DefaultRouter()
@@ -12,6 +13,8 @@ router.register('recipes', RecipeViewSet, basename='recipe')
 router.register('users', UserViewSet, basename='users')
 
 urlpatterns = [
+    path('catalog/', catalog, name='catalog'),
+    path('catalog/<str:version>/', catalog, name='catalog-version'),
     path('', include(router.urls)),
     path('auth/', include('djoser.urls.authtoken'))
 ]
@@ -1,23 +1,88 @@
-from django.db.models import Exists, OuterRef
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (BooleanField, Exists, OuterRef, Prefetch,
+                              Subquery, Value)
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.contrib.auth import get_user_model
+from django.views.decorators.http import require_safe
 from rest_framework import (mixins, viewsets, permissions, response,
-                            status, exceptions)
+                            status, exceptions, renderers)
 from rest_framework.decorators import action
 from django_filters import rest_framework as dj_filters
 from djoser.views import UserViewSet as DjoserUserViewSet
 
-from recipes.models import Ingredient, ShoppingList, Tag, Recipe, Favorite
-from api.serializers import (IngredientSerializer, TagSerializer,
-                             RecipeSerializer, RecipeWriteSerializer,
-                             ShortRecipeSerializer, UserWithRecipesSerializer)
+from recipes.models import (Ingredient, ShoppingList, Tag, Recipe, Favorite,
+                            ShoppingCartIngredient, change_recipes_count)
+from api.serializers import (IdsSerializer, IngredientSerializer,
+                             TagSerializer, RecipeSerializer,
+                             RecipeWriteSerializer, ShortRecipeSerializer,
+                             UserWithRecipesSerializer,
+                             ShoppingCartIngredientSerializer)
+from api.autocomplete import ingredient_index
+from api.catalog import catalog_bundle
 from api.filters import RecipeFilter, IngredientFilter
+from api.fragments import serialize_recipes
 from api.permissions import IsAuthorOfContentOrReadOnly
+from api.renderers import (CSVRenderer, JSONRenderer, PDFRenderer,
+                           PlainTextRenderer, ShoppingListRenderer)
 from api.services import ShoppingListGenerator
 
 
 User = get_user_model()
 
+# outcomes of bulk operation for changed and unchanged objects
+BULK_STATUSES = {
+    'POST': ('added', 'exists'),
+    'DELETE': ('removed', 'missing'),
+}
+
+
+def annotate_is_subscribed(queryset, user):
+    """Annotates users queryset with `is_subscribed` flag: whether given
+    user is subscribed to each of users."""
+    if user.is_anonymous:
+        is_subscribed = Value(False, output_field=BooleanField())
+    else:
+        is_subscribed = Exists(
+            User.subscribed_to.through.objects.filter(
+                from_foodgramuser=user.pk,
+                to_foodgramuser=OuterRef('pk')
+            )
+        )
+    return queryset.annotate(is_subscribed=is_subscribed)
+
+
+def get_bulk_ids(request) -> list:
+    """Returns validated ids of bulk request without duplicates."""
+    serializer = IdsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return list(dict.fromkeys(serializer.validated_data['ids']))
+
+
+def get_bulk_results(ids, found, changed, method, invalid=None) -> dict:
+    """
+    Returns outcome of bulk operation for every id: `added`/`removed` for
+    changed objects, `exists`/`missing` for unchanged ones, `not_found` for
+    missing objects or outcome from `invalid` mapping for rejected ids.
+    """
+    changed_status, unchanged_status = BULK_STATUSES[method]
+    invalid = invalid or {}
+    results = []
+    for pk in ids:
+        if pk in invalid:
+            outcome = invalid[pk]
+        elif pk not in found:
+            outcome = 'not_found'
+        elif pk in changed:
+            outcome = changed_status
+        else:
+            outcome = unchanged_status
+        results.append({'id': pk, 'status': outcome})
+    return {'results': results}
+
 
 class TagViewSet(mixins.ListModelMixin,
                  mixins.RetrieveModelMixin,
@@ -36,9 +101,26 @@ class IngredientViewSet(mixins.ListModelMixin,
     filterset_class = IngredientFilter
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if not name or not settings.INGREDIENT_INDEX_ENABLED:
+            return super().list(request, *args, **kwargs)
+        try:
+            limit = int(request.query_params['limit'])
+        except (KeyError, ValueError):
+            limit = None
+        return response.Response(
+            ingredient_index.search(
+                name,
+                limit=limit if limit and limit > 0 else None,
+                fuzzy=request.query_params.get('fuzzy') in ('1', 'true')
+            )
+        )
+
 
 class UserRecipeMixin:
 
+    @transaction.atomic
     def modify_user_to_recipe_relation(self, request, pk=None,
                                        model_class=None):
         """
@@ -47,29 +129,46 @@ class UserRecipeMixin:
         """
         user = self.request.user
         recipe = get_object_or_404(Recipe, pk=pk)
-        related_model_entry = model_class.objects.filter(
-            user=user,
-            recipe=recipe
-        )
         if request.method == 'POST':
-            if related_model_entry:
+            if not model_class.add(user, recipe):
                 raise exceptions.ValidationError(
                     'Ошибка! Вы уже добавили этот рецепт.'
                 )
-            model_class.objects.create(user=user, recipe=recipe)
             serializer = ShortRecipeSerializer(instance=recipe)
             return response.Response(
                 serializer.data, status=status.HTTP_201_CREATED
             )
         if request.method == 'DELETE':
-            if not related_model_entry:
+            if not model_class.remove(user, recipe):
                 raise exceptions.ValidationError(
                     'Ошибка! Этот рецепт отсутсвует в списке.'
                 )
-            related_model_entry.delete()
             return response.Response(status=status.HTTP_204_NO_CONTENT)
         raise exceptions.APIException('Используемый http-метод не разрешен')
 
+    @transaction.atomic
+    def modify_user_to_recipes_relation(self, request, model_class=None):
+        """
+        Creates/removes user-recipe entries of given model_class for recipes
+        from `ids` list, returns outcome for every id.
+        model_class should be a child of UserRecipe model.
+        """
+        ids = get_bulk_ids(request)
+        recipes = set(
+            Recipe.objects.filter(pk__in=ids).values_list('pk', flat=True)
+        )
+        if request.method == 'POST':
+            changed = model_class.add_many(request.user, recipes)
+        elif request.method == 'DELETE':
+            changed = model_class.remove_many(request.user, recipes)
+        else:
+            raise exceptions.APIException(
+                'Используемый http-метод не разрешен'
+            )
+        return response.Response(
+            get_bulk_results(ids, recipes, changed, request.method)
+        )
+
 
 class RecipeViewSet(UserRecipeMixin, viewsets.ModelViewSet):
     permission_classes = (
@@ -81,8 +180,11 @@ class RecipeViewSet(UserRecipeMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
-        return (
-            Recipe.objects.all().annotate(
+        queryset = Recipe.objects.all()
+        # anonymous user has no favorites and shopping list, serializer
+        # returns false for missing flags
+        if user.is_authenticated:
+            queryset = queryset.annotate(
                 is_favorited=Exists(
                     Favorite.objects.filter(
                         recipe=OuterRef('pk'), user=user.pk
@@ -93,6 +195,33 @@ class RecipeViewSet(UserRecipeMixin, viewsets.ModelViewSet):
                         recipe=OuterRef('pk'), user=user.pk)
                 )
             )
+        if self.request.method not in permissions.SAFE_METHODS:
+            return queryset.select_related('author')
+        # related objects are fetched only for recipes missing in cache,
+        # see serialize_recipes
+        if not user.is_authenticated:
+            return queryset
+        return queryset.annotate(
+            is_author_subscribed=Exists(
+                User.subscribed_to.through.objects.filter(
+                    from_foodgramuser=user.pk,
+                    to_foodgramuser=OuterRef('author')
+                )
+            )
+        )
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return response.Response(
+                serialize_recipes(list(queryset), request)
+            )
+        return self.get_paginated_response(serialize_recipes(page, request))
+
+    def retrieve(self, request, *args, **kwargs):
+        return response.Response(
+            serialize_recipes([self.get_object()], request)[0]
         )
 
     def get_serializer_class(self):
@@ -103,12 +232,54 @@ class RecipeViewSet(UserRecipeMixin, viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        # shopping carts are updated by pre_delete receiver
+        change_recipes_count(instance.author_id, -1)
+        instance.delete()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        # shopping list renderers can't render errors, render them as JSON;
+        # renderer is not set, if content negotiation failed, then DRF would
+        # take the first one of the action (PDF)
+        renderer = getattr(request, 'accepted_renderer', None)
+        if getattr(response, 'exception', False) and (
+            renderer is None or isinstance(renderer, ShoppingListRenderer)
+        ):
+            request.accepted_renderer = renderers.JSONRenderer()
+            request.accepted_media_type = request.accepted_renderer.media_type
+        return super().finalize_response(request, response, *args, **kwargs)
+
     @action(methods=['GET'], detail=False,
             permission_classes=[permissions.IsAuthenticated],
+            renderer_classes=[PDFRenderer, PlainTextRenderer, CSVRenderer,
+                              JSONRenderer],
             url_path='download_shopping_cart')
     def download_shopping_list(self, request):
         shopping_list = ShoppingListGenerator(self.request.user)
-        return shopping_list.generate_pdf()
+        export_format = request.accepted_renderer.format
+        if export_format != PDFRenderer.format:
+            return shopping_list.stream(export_format)
+        etag = shopping_list.get_etag()
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            # render errors are raised, so ETag is sent with PDF only
+            response = shopping_list.generate_pdf()
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    @action(methods=['GET'], detail=False,
+            permission_classes=[permissions.IsAuthenticated],
+            url_path='shopping_cart_summary')
+    def shopping_cart_summary(self, request):
+        ingredients = ShoppingCartIngredient.objects.filter(
+            user=self.request.user, amount__gt=0
+        ).select_related('ingredient').order_by(
+            'ingredient__name', 'ingredient__measurement_unit'
+        )
+        serializer = ShoppingCartIngredientSerializer(ingredients, many=True)
+        return response.Response(serializer.data)
 
     @action(methods=['POST', 'DELETE'], detail=True,
             permission_classes=[permissions.IsAuthenticated],
@@ -122,23 +293,60 @@ class RecipeViewSet(UserRecipeMixin, viewsets.ModelViewSet):
     def modify_favorites(self, request, pk=None):
         return self.modify_user_to_recipe_relation(request, pk, Favorite)
 
+    @action(methods=['POST', 'DELETE'], detail=False,
+            permission_classes=[permissions.IsAuthenticated],
+            url_path='shopping_cart')
+    def modify_shopping_list_bulk(self, request):
+        return self.modify_user_to_recipes_relation(request, ShoppingList)
+
+    @action(methods=['POST', 'DELETE'], detail=False,
+            permission_classes=[permissions.IsAuthenticated],
+            url_path='favorite')
+    def modify_favorites_bulk(self, request):
+        return self.modify_user_to_recipes_relation(request, Favorite)
+
 
 class UserViewSet(DjoserUserViewSet):
 
+    def get_queryset(self):
+        return annotate_is_subscribed(
+            super().get_queryset(), self.request.user
+        )
+
     @action(methods=['GET'], detail=False,
             permission_classes=[permissions.IsAuthenticated],
             url_path='subscriptions')
     def get_subscriptions(self, request):
-        users = self.request.user.subscribed_to.all()
+        recipes_limit = self.get_recipes_limit()
+        recipes = Recipe.objects.all()
+        if recipes_limit:
+            # only first `recipes_limit` recipes of every author are fetched
+            recipes = recipes.filter(
+                pk__in=Subquery(
+                    Recipe.objects.filter(
+                        author=OuterRef('author')
+                    ).values('pk')[:recipes_limit]
+                )
+            )
+        users = self.request.user.subscribed_to.prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='limited_recipes')
+        )
         paginated_qs = self.paginate_queryset(users)
         serializer = UserWithRecipesSerializer(paginated_qs, many=True)
-        recipes_limit = self.request.query_params.get('recipes_limit')
-        serializer.context['recipes_limit'] = recipes_limit
         return self.get_paginated_response(serializer.data)
 
+    def get_recipes_limit(self):
+        """Returns `recipes_limit` query param, None if it is not valid."""
+        try:
+            recipes_limit = int(self.request.query_params['recipes_limit'])
+        except (KeyError, ValueError):
+            return None
+        return recipes_limit if recipes_limit > 0 else None
+
     @action(methods=['POST', 'DELETE'], detail=True,
             permission_classes=[permissions.IsAuthenticated],
             url_path='subscribe')
+    @transaction.atomic
     def modify_subscriptions(self, request, id=None):
         user = self.request.user
         subscribed_user = get_object_or_404(User, id=id)
@@ -151,8 +359,11 @@ class UserViewSet(DjoserUserViewSet):
                 raise exceptions.ValidationError(
                     'Ошибка! Вы уже подписаны на этого пользователя.'
                 )
-            user.subscribed_to.add(subscribed_user)
-            serializer = UserWithRecipesSerializer(instance=subscribed_user)
+            user.subscribe(subscribed_user)
+            serializer = UserWithRecipesSerializer(
+                instance=subscribed_user,
+                context={'recipes_limit': self.get_recipes_limit()}
+            )
             return response.Response(
                 serializer.data, status=status.HTTP_201_CREATED
             )
@@ -161,6 +372,76 @@ class UserViewSet(DjoserUserViewSet):
                 raise exceptions.ValidationError(
                     'Ошибка! Вы не подписаны на этого пользователя.'
                 )
-            user.subscribed_to.remove(subscribed_user)
+            user.unsubscribe(subscribed_user)
             return response.Response(status=status.HTTP_204_NO_CONTENT)
         raise exceptions.APIException('Используемый http-метод не разрешен')
+
+    @action(methods=['POST', 'DELETE'], detail=False,
+            permission_classes=[permissions.IsAuthenticated],
+            url_path='subscribe')
+    @transaction.atomic
+    def modify_subscriptions_bulk(self, request):
+        user = self.request.user
+        ids = get_bulk_ids(request)
+        authors = set(
+            User.objects.filter(pk__in=ids).exclude(pk=user.pk).values_list(
+                'pk', flat=True
+            )
+        )
+        if request.method == 'POST':
+            changed = user.subscribe_many(authors)
+        elif request.method == 'DELETE':
+            changed = user.unsubscribe_many(authors)
+        else:
+            raise exceptions.APIException(
+                'Используемый http-метод не разрешен'
+            )
+        return response.Response(
+            get_bulk_results(
+                ids, authors, changed, request.method, {user.pk: 'self'}
+            )
+        )
+
+
+@require_safe
+def catalog(request, version=None):
+    """
+    Returns prebuilt ingredients and tags bundle. Unversioned bundle is
+    revalidated by ETag, bundle under its version never changes and may be
+    cached forever. Plain Django view, so no authentication queries are made.
+    """
+    bundle = catalog_bundle.get_snapshot()
+    if version is not None and version != bundle.version:
+        # version could be built by another process, which noticed catalog
+        # change before this one
+        bundle = catalog_bundle.refresh()
+        if version != bundle.version:
+            raise Http404('Версия каталога устарела.')
+    encoding = (
+        'gzip' if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        else None
+    )
+    etag = bundle.get_etag(encoding)
+    catalog_response = get_conditional_response(request, etag=etag)
+    if catalog_response is None:
+        catalog_response = HttpResponse(
+            bundle.gzip_body if encoding else bundle.body,
+            content_type='application/json'
+        )
+        if encoding:
+            catalog_response['Content-Encoding'] = encoding
+    catalog_response['ETag'] = etag
+    catalog_response['Vary'] = 'Accept-Encoding'
+    catalog_response['Content-Location'] = reverse(
+        'catalog-version', args=[bundle.version]
+    )
+    if version is None:
+        patch_cache_control(catalog_response, public=True, no_cache=True)
+    else:
+        patch_cache_control(
+            catalog_response,
+            public=True,
+            max_age=settings.CATALOG_BUNDLE_MAX_AGE,
+            immutable=True
+        )
+    return catalog_response
@@ -30,15 +30,18 @@ INSTALLED_APPS = [
     'api.apps.ApiConfig'
 ]
 
+# API authenticates by tokens, so requests to it skip sessions, CSRF
+# protection and messages, which are used by admin only
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'api.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
+    'api.middleware.CsrfViewMiddleware',
+    'api.middleware.AuthenticationMiddleware',
+    'api.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
+API_URL_PREFIX = '/api/'
 
 ROOT_URLCONF = 'backend.urls'
 
@@ -116,11 +119,34 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PAGINATION_CLASS': 'api.paginators.ModifiedPageNumberPagination',
 }
 
+# Rendered shopping lists are cached for a day, cache is invalidated
+# when user's shopping cart changes
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Shopping list PDF renderer: `html` renders HTML template with xhtml2pdf,
+# `reportlab` draws the list straight onto PDF canvas, which is much faster
+SHOPPING_LIST_PDF_RENDERER = os.getenv(
+    'SHOPPING_LIST_PDF_RENDERER', default='html'
+)
+
+# Shopping lists are rendered to PDF in a separate process pool:
+# number of processes, number of renders allowed to wait for a free process
+# and time (in seconds) request waits for the render result
+SHOPPING_LIST_RENDER_WORKERS = int(
+    os.getenv('SHOPPING_LIST_RENDER_WORKERS', default=2)
+)
+SHOPPING_LIST_RENDER_QUEUE_SIZE = int(
+    os.getenv('SHOPPING_LIST_RENDER_QUEUE_SIZE', default=4)
+)
+SHOPPING_LIST_RENDER_TIMEOUT = int(
+    os.getenv('SHOPPING_LIST_RENDER_TIMEOUT', default=10)
+)
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'HIDE_USERS': False,
@@ -142,3 +168,54 @@ DJOSER = {
         'current_user': 'api.serializers.UserSerializer',
     }
 }
+
+# Tag ids are resolved by slug from in-process cache, which is reloaded
+# after timeout (in seconds) or when an unknown slug is requested
+TAG_SLUGS_CACHE_TIMEOUT = 60
+
+# Ingredients are searched by name in in-process index, which is rebuilt
+# after ingredients change. Timeout (in seconds) is used only with locmem
+# SNAPSHOT_STAMP_CACHE_ALIAS. Similarity is the minimal share of common
+# trigrams for typo-tolerant matches.
+INGREDIENT_INDEX_ENABLED = True
+INGREDIENT_INDEX_TIMEOUT = 60 * 5
+INGREDIENT_INDEX_SIMILARITY = 0.3
+
+# Ingredients and tags catalog bundle is rebuilt after they change, timeout
+# (in seconds) is used only with locmem SNAPSHOT_STAMP_CACHE_ALIAS;
+# versioned bundles are cached by clients for a year
+CATALOG_BUNDLE_TIMEOUT = 60 * 5
+CATALOG_BUNDLE_MAX_AGE = 60 * 60 * 24 * 365
+
+# In-process ingredient index and catalog bundle are rebuilt, when change
+# stamp in SNAPSHOT_STAMP_CACHE_ALIAS cache is replaced. It should be shared
+# by processes (memcached, redis), otherwise changes made by other processes
+# are noticed after timeouts above.
+SNAPSHOT_STAMP_CACHE_ALIAS = 'default'
+
+# Users are cached by authentication token in in-process LRU of given size
+# and in TOKEN_CACHE_ALIAS cache, timeouts are in seconds. Entries are
+# removed on logout and user changes, other processes see that after local
+# timeout. TOKEN_CACHE_ALIAS should be shared by processes (memcached, redis),
+# in-process locmem cache keeps entries for local timeout only.
+TOKEN_CACHE_ALIAS = 'default'
+TOKEN_CACHE_TIMEOUT = 60 * 5
+TOKEN_CACHE_LOCAL_TIMEOUT = 10
+TOKEN_CACHE_SIZE = 1000
+
+# Maximal number of ids in requests to bulk endpoints
+BULK_IDS_MAX_LENGTH = 100
+
+# Viewer-independent part of serialized recipes is cached per recipe
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'recipes': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'recipes',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+RECIPE_CACHE_ALIAS = 'recipes'
+RECIPE_CACHE_TIMEOUT = 60 * 60
@@ -1,3 +1,6 @@
+import os
+import tempfile
+
 from .settings import *
 
 
@@ -5,5 +8,14 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # file database lets concurrent requests of tests wait for each
+        # other, instead of failing on locked in-memory tables; name is
+        # unique, so test runs on one machine don't share the database
+        'TEST': {
+            'NAME': os.path.join(
+                tempfile.gettempdir(), f'foodgram_test_{os.getpid()}.db'
+            )
+        },
+        'OPTIONS': {'timeout': 20},
     }
 }
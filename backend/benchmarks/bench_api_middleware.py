@@ -0,0 +1,34 @@
+import pytest
+from rest_framework.test import APIClient
+
+from benchmarks.utils import create_tags, measure, report
+
+TAGS_ENDPOINT = '/api/tags/'
+FULL_MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('stack', ['full', 'lean'])
+def test_api_middleware(settings, stack):
+    create_tags(10)
+    if stack == 'full':
+        settings.MIDDLEWARE = FULL_MIDDLEWARE
+    # middleware chain is loaded by client on first request
+    client = APIClient()
+
+    def get_tags():
+        response = client.get(TAGS_ENDPOINT)
+        assert response.status_code == 200
+
+    get_tags()
+    time_ms, queries = measure(get_tags, repeat=500)
+    report(f'{stack} middleware, GET {TAGS_ENDPOINT}',
+           median_ms=round(time_ms, 3), queries=queries)
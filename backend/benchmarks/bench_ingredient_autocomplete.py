@@ -0,0 +1,33 @@
+import json
+
+import pytest
+from django.conf import settings as django_settings
+
+from recipes.models import Ingredient
+from benchmarks.utils import measure, report
+
+INGREDIENTS_ENDPOINT = '/api/ingredients/'
+QUERIES = ('с', 'сах', 'масло', 'ово', 'сохар')
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('index_enabled', [False, True])
+def test_ingredients_autocomplete(guest_client, settings, index_enabled):
+    with open(django_settings.BASE_DIR.parent / 'data/ingredients.json',
+              encoding='utf-8') as file:
+        Ingredient.objects.bulk_create(
+            Ingredient(**entry) for entry in json.load(file)
+        )
+    settings.INGREDIENT_INDEX_ENABLED = index_enabled
+    path = 'index' if index_enabled else 'sql'
+
+    for query in QUERIES:
+        def search():
+            response = guest_client.get(
+                INGREDIENTS_ENDPOINT + f'?name={query}&limit=10'
+            )
+            assert response.status_code == 200
+
+        time_ms, queries = measure(search, repeat=20)
+        report(f'{path}, {Ingredient.objects.count()} ingredients, '
+               f'name={query}', median_ms=round(time_ms, 2), queries=queries)
@@ -0,0 +1,44 @@
+import pytest
+
+from django.conf import settings
+from django.template.loader import get_template
+
+from api.pdf import html_to_pdf, rows_to_pdf
+from benchmarks.utils import measure, report
+
+pytestmark = pytest.mark.django_db
+
+
+def get_ingredients(count):
+    return [
+        {'name': f'Ингредиент {i}', 'measurement_unit': 'г', 'amount': i}
+        for i in range(count)
+    ]
+
+
+@pytest.mark.parametrize('lines', [10, 100, 1000])
+def test_html_renderer(lines):
+    ingredients = get_ingredients(lines)
+
+    def render():
+        template = get_template('shopping_list_template.html')
+        html = template.render({'ingredients': ingredients})
+        assert html_to_pdf(html, settings.STATIC_ROOT, settings.STATIC_URL)
+
+    time_ms, _ = measure(render, repeat=3)
+    report(f'html renderer, {lines} lines', median_ms=round(time_ms, 1))
+
+
+@pytest.mark.parametrize('lines', [10, 100, 1000])
+def test_reportlab_renderer(lines):
+    ingredients = get_ingredients(lines)
+
+    def render():
+        rows = [
+            (entry['name'], entry['measurement_unit'], entry['amount'])
+            for entry in ingredients
+        ]
+        assert rows_to_pdf(rows)
+
+    time_ms, _ = measure(render, repeat=3)
+    report(f'reportlab renderer, {lines} lines', median_ms=round(time_ms, 1))
@@ -0,0 +1,34 @@
+import pytest
+
+from django.db.models import F
+
+from api.filters import RECIPE_ORDERINGS
+from recipes.models import Recipe
+from benchmarks.utils import create_recipes, create_tags, measure, report
+
+RECIPES_ENDPOINT = '/api/recipes/'
+RECIPES_COUNT = 100_000
+
+
+@pytest.mark.django_db
+def test_recipes_list_ordering(guest_client, test_user_1, test_user_2):
+    tags = create_tags(1)
+    for author in (test_user_1, test_user_2):
+        create_recipes(author, RECIPES_COUNT // 2, tags=tags)
+    Recipe.objects.update(favorites_count=F('id') % 997)
+
+    for ordering, fields in RECIPE_ORDERINGS.items():
+        for filters in ('', f'&author={test_user_1.pk}'):
+            def get_recipes():
+                response = guest_client.get(
+                    RECIPES_ENDPOINT + f'?ordering={ordering}' + filters
+                )
+                assert response.status_code == 200
+
+            time_ms, queries = measure(get_recipes)
+            recipes = Recipe.objects.order_by(*fields)
+            if filters:
+                recipes = recipes.filter(author=test_user_1)
+            plan = recipes[:6].explain().replace('\n', '; ')
+            report(f'{RECIPES_COUNT} recipes, ordering={ordering}{filters}',
+                   median_ms=round(time_ms, 1), queries=queries, plan=plan)
@@ -0,0 +1,26 @@
+import pytest
+
+from recipes.models import Recipe
+from benchmarks.utils import create_recipes, measure, report
+
+RECIPES_ENDPOINT = '/api/recipes/'
+RECIPES_COUNT = 100_000
+
+
+@pytest.mark.django_db
+def test_search_recipes(guest_client, test_user_1, test_user_2):
+    for author in (test_user_1, test_user_2):
+        create_recipes(author, RECIPES_COUNT // 2)
+    # one recipe of a thousand is a pie
+    pies = list(Recipe.objects.values_list('pk', flat=True))[::1000]
+    Recipe.objects.filter(pk__in=pies).update(name='Пирог с капустой')
+
+    for params in ('search=пирог', f'search=пирог&author={test_user_1.pk}',
+                   'search=описание'):
+        def search():
+            response = guest_client.get(RECIPES_ENDPOINT + '?' + params)
+            assert response.status_code == 200
+
+        time_ms, queries = measure(search)
+        report(f'{RECIPES_COUNT} recipes, {params}',
+               median_ms=round(time_ms, 1), queries=queries)
@@ -0,0 +1,70 @@
+import pytest
+
+from benchmarks.utils import create_ingredients, create_tags, measure, report
+
+RECIPES_ENDPOINT = '/api/recipes/'
+IMAGE = 'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAgMAAABieywaAAAACVBMVEUAAAD///9fX1/S0ecCAAAACXBIWXMAAA7EAAAOxAGVKw4bAAAACklEQVQImWNoAAAAggCByxOyYQAAAABJRU5ErkJggg=='  # noqa
+
+
+def get_recipe_data(ingredients, tags, amount=1):
+    return {
+        'ingredients': [
+            {'id': ingredient.pk, 'amount': amount}
+            for ingredient in ingredients
+        ],
+        'tags': [tag.pk for tag in tags],
+        'image': IMAGE,
+        'name': 'Рецепт',
+        'text': 'Описание рецепта',
+        'cooking_time': 10
+    }
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('ingredients_count', [5, 25])
+def test_create_recipe(authorized_client_1, ingredients_count):
+    ingredients = create_ingredients(ingredients_count)
+    data = get_recipe_data(ingredients, create_tags(3))
+
+    def create():
+        response = authorized_client_1.post(
+            RECIPES_ENDPOINT, data, format='json'
+        )
+        assert response.status_code == 201
+
+    time_ms, queries = measure(create)
+    report(f'create recipe, {ingredients_count} ingredients',
+           median_ms=round(time_ms, 1), queries=queries)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('ingredients_count', [5, 25])
+def test_update_recipe(authorized_client_1, ingredients_count):
+    ingredients = create_ingredients(ingredients_count * 2)
+    tags = create_tags(6)
+    response = authorized_client_1.post(
+        RECIPES_ENDPOINT,
+        get_recipe_data(ingredients[:ingredients_count], tags[:3]),
+        format='json'
+    )
+    endpoint = RECIPES_ENDPOINT + f'{response.json()["id"]}/'
+    # half of ingredients and tags are replaced, the rest change amounts
+    payloads = [
+        get_recipe_data(
+            ingredients[shift:shift + ingredients_count],
+            tags[shift % 3:shift % 3 + 3],
+            amount=shift + 1
+        )
+        for shift in (ingredients_count // 2, 0)
+    ]
+    calls = []
+
+    def update():
+        data = payloads[len(calls) % 2]
+        calls.append(data)
+        response = authorized_client_1.patch(endpoint, data, format='json')
+        assert response.status_code == 200
+
+    time_ms, queries = measure(update, repeat=6)
+    report(f'update recipe, {ingredients_count} ingredients',
+           median_ms=round(time_ms, 1), queries=queries)
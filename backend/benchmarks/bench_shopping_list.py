@@ -0,0 +1,29 @@
+import pytest
+
+from django.core.cache import cache
+from recipes.models import ShoppingCartIngredient, ShoppingList
+from benchmarks.utils import (create_ingredients, create_recipes, measure,
+                              report)
+
+SHOPPING_LIST_ENDPOINT = '/api/recipes/download_shopping_cart/'
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('cart_size', [10, 100, 1000])
+def test_download_shopping_list(authorized_client_1, test_user_1,
+                                test_user_2, cart_size):
+    ingredients = create_ingredients(200)
+    recipes = create_recipes(test_user_2, cart_size, ingredients=ingredients)
+    ShoppingList.objects.bulk_create(
+        ShoppingList(user=test_user_1, recipe=recipe) for recipe in recipes
+    )
+    ShoppingCartIngredient.objects.rebuild([test_user_1.pk])
+
+    def download():
+        cache.clear()
+        response = authorized_client_1.get(SHOPPING_LIST_ENDPOINT)
+        assert response.status_code == 200
+
+    time_ms, queries = measure(download)
+    report(f'download shopping list, {cart_size} recipes',
+           median_ms=round(time_ms, 1), queries=queries)
@@ -0,0 +1,30 @@
+import pytest
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.views import APIView
+
+from api.authentication import CachedTokenAuthentication
+from benchmarks.utils import create_tags, measure, report
+
+TAGS_ENDPOINT = '/api/tags/'
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    'authentication_class',
+    [TokenAuthentication, CachedTokenAuthentication]
+)
+def test_token_authentication(authorized_client_1, monkeypatch,
+                              authentication_class):
+    create_tags(10)
+    monkeypatch.setattr(
+        APIView, 'authentication_classes', [authentication_class]
+    )
+
+    def get_tags():
+        response = authorized_client_1.get(TAGS_ENDPOINT)
+        assert response.status_code == 200
+
+    get_tags()
+    time_ms, queries = measure(get_tags, repeat=200)
+    report(f'{authentication_class.__name__}, GET {TAGS_ENDPOINT}',
+           median_ms=round(time_ms, 3), queries=queries)
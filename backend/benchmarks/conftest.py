@@ -0,0 +1,2 @@
+from tests.conftest import (authorized_client_1, guest_client,  # noqa F401
+                            media_root, test_user_1, test_user_2)
@@ -0,0 +1,80 @@
+import statistics
+import time
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from recipes.models import Ingredient, Recipe, RecipeIngredients, Tag
+
+
+def create_ingredients(count):
+    Ingredient.objects.bulk_create(
+        Ingredient(name=f'Ингредиент {i}', measurement_unit='г')
+        for i in range(count)
+    )
+    return list(Ingredient.objects.all())
+
+
+def create_tags(count):
+    Tag.objects.bulk_create(
+        Tag(name=f'Тег {i}', slug=f'tag_{i}') for i in range(count)
+    )
+    return list(Tag.objects.all())
+
+
+def create_recipes(author, count, tags=(), ingredients=(),
+                   ingredients_per_recipe=10):
+    """Bulk creates `count` recipes of `author`. Every recipe gets all given
+    tags and `ingredients_per_recipe` ingredients from `ingredients`."""
+    Recipe.objects.bulk_create(
+        (
+            Recipe(
+                author=author,
+                image='',
+                name=f'Рецепт {i}',
+                text=f'Описание рецепта {i}',
+                cooking_time=i % 120 + 1
+            ) for i in range(count)
+        ),
+        batch_size=1000
+    )
+    recipes = list(Recipe.objects.filter(author=author))
+    Recipe.tags.through.objects.bulk_create(
+        (
+            Recipe.tags.through(recipe=recipe, tag=tag)
+            for recipe in recipes for tag in tags
+        ),
+        batch_size=1000
+    )
+    if ingredients:
+        RecipeIngredients.objects.bulk_create(
+            (
+                RecipeIngredients(
+                    recipe=recipe,
+                    ingredient=ingredients[(i + j) % len(ingredients)],
+                    amount=j + 1
+                )
+                for i, recipe in enumerate(recipes)
+                for j in range(ingredients_per_recipe)
+            ),
+            batch_size=1000
+        )
+    return recipes
+
+
+def measure(func, repeat=5):
+    """Calls `func` `repeat` times, returns median time in milliseconds and
+    number of queries of the last call."""
+    timings = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), len(queries)
+
+
+def report(title, **results):
+    """Prints benchmark results as a single line."""
+    values = ', '.join(f'{key}={value}' for key, value in results.items())
+    print(f'\n[benchmark] {title}: {values}')
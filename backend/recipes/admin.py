@@ -1,8 +1,14 @@
+from collections import Counter
+
 from django.contrib import admin, messages
 from django.conf.urls import url
+from django.db.models import F
 from django.http import HttpResponseRedirect
 
-from recipes.models import Tag, Ingredient, Recipe
+from recipes.models import (Tag, Ingredient, Recipe, ShoppingCartIngredient,
+                            ShoppingList, bump_shopping_cart_version,
+                            change_recipes_count)
+from recipes.signals import catalog_changed
 
 
 @admin.register(Tag)
@@ -30,6 +36,7 @@ class IngredientAdmin(admin.ModelAdmin):
             for entry in json_data:
                 ingredients.append(Ingredient(**entry))
             Ingredient.objects.bulk_create(ingredients)
+            catalog_changed.send(sender=Ingredient)
             self.message_user(request, 'Ингредиенты импортированы')
         except Exception as e:
             self.message_user(request, f'Ошибка: {e}', level=messages.ERROR)
@@ -56,5 +63,35 @@ class RecipeAdmin(admin.ModelAdmin):
 
     @admin.display(description='В избранном у')
     def favorite_count(self, obj):
-        count = obj.favorite_recipes.all().count()
-        return f'{count} чел.'
+        return f'{obj.favorites_count} чел.'
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            obj.cache_version = F('cache_version') + 1
+        super().save_model(request, obj, form, change)
+        if not change:
+            change_recipes_count(obj.author_id, 1)
+        elif 'author' in form.changed_data:
+            change_recipes_count(form.initial['author'], -1)
+            change_recipes_count(obj.author_id, 1)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        change_recipes_count(obj.author_id, -1)
+
+    def delete_queryset(self, request, queryset):
+        authors = Counter(queryset.values_list('author', flat=True))
+        super().delete_queryset(request, queryset)
+        for author, count in authors.items():
+            change_recipes_count(author, -count)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if change:
+            users = list(
+                ShoppingList.objects.filter(recipe=form.instance).values_list(
+                    'user', flat=True
+                )
+            )
+            ShoppingCartIngredient.objects.rebuild(users)
+            bump_shopping_cart_version(users)
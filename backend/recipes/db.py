@@ -0,0 +1,87 @@
+from django.db import connections, router
+
+
+def can_return_from_insert(connection) -> bool:
+    """Whether database returns values of inserted rows, skipping rows,
+    which conflict with unique constraints."""
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 35)
+    return False
+
+
+def insert_ignoring_conflicts(model, fields, rows, returning=None):
+    """
+    Inserts rows (tuples of values of given fields) of model, skipping rows,
+    which conflict with unique constraints, so concurrent requests can't
+    insert the same row twice. Returns number of inserted rows or, if
+    `returning` field (one of `fields`) is given, set of its values in
+    inserted rows. Rows are inserted with a single INSERT, unless database
+    can't return inserted values, then row by row.
+    """
+    connection = connections[router.db_for_write(model)]
+    quote_name = connection.ops.quote_name
+    sql = '{insert} {table} ({columns}) VALUES {values}{suffix}'.format(
+        insert=connection.ops.insert_statement(ignore_conflicts=True),
+        table=quote_name(model._meta.db_table),
+        columns=', '.join(
+            quote_name(model._meta.get_field(field).column)
+            for field in fields
+        ),
+        values='{values}',
+        suffix=connection.ops.ignore_conflicts_suffix_sql(
+            ignore_conflicts=True
+        )
+    )
+    placeholders = '({})'.format(', '.join(['%s'] * len(fields)))
+    with connection.cursor() as cursor:
+        if returning is None:
+            cursor.execute(
+                sql.format(values=', '.join([placeholders] * len(rows))),
+                [value for row in rows for value in row]
+            )
+            return cursor.rowcount
+        index = fields.index(returning)
+        if not can_return_from_insert(connection):
+            inserted = set()
+            for row in rows:
+                cursor.execute(sql.format(values=placeholders), row)
+                if cursor.rowcount:
+                    inserted.add(row[index])
+            return inserted
+        cursor.execute(
+            sql.format(values=', '.join([placeholders] * len(rows)))
+            + ' RETURNING '
+            + quote_name(model._meta.get_field(returning).column),
+            [value for row in rows for value in row]
+        )
+        return {value for value, in cursor.fetchall()}
+
+
+class CountersMixin:
+    """
+    Model mixin, which doesn't save `COUNTER_FIELDS` to existing rows. They
+    are changed by UPDATE queries only, so saving of outdated instance (e.g.
+    loaded at the start of request or cached) doesn't roll them back.
+    """
+    COUNTER_FIELDS = set()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            kwargs['update_fields'] = self.get_update_fields(
+                kwargs.get('update_fields')
+            )
+        super().save(*args, **kwargs)
+
+    def get_update_fields(self, update_fields=None) -> list:
+        """Returns fields to save to existing row, counters excluded."""
+        if update_fields is None:
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+            ]
+        return [
+            field for field in update_fields
+            if field not in self.COUNTER_FIELDS
+        ]
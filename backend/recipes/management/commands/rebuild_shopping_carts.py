@@ -0,0 +1,60 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Sum
+
+from recipes.models import (RecipeIngredients, ShoppingCartIngredient,
+                            bump_shopping_cart_version)
+
+
+class Command(BaseCommand):
+    help = (
+        'Checks that shopping cart totals match users shopping lists and '
+        'rebuilds totals of inconsistent carts.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report inconsistent carts, do not rebuild them.'
+        )
+
+    def get_totals(self, queryset, user_field, amount_field):
+        totals = defaultdict(dict)
+        for user, ingredient, amount in queryset.values_list(
+            user_field, 'ingredient', amount_field
+        ).iterator():
+            if amount:
+                totals[user][ingredient] = amount
+        return totals
+
+    def handle(self, *args, **options):
+        expected = self.get_totals(
+            RecipeIngredients.objects.filter(
+                recipe__shoppinglist_recipes__isnull=False
+            ).values(
+                'ingredient', user=F('recipe__shoppinglist_recipes__user')
+            ).annotate(total=Sum('amount')),
+            'user', 'total'
+        )
+        actual = self.get_totals(
+            ShoppingCartIngredient.objects.all(), 'user', 'amount'
+        )
+        users = [
+            user for user in {*expected, *actual}
+            if expected.get(user) != actual.get(user)
+        ]
+        if not users:
+            self.stdout.write('Расхождений не найдено')
+            return
+        self.stdout.write(
+            f'Расхождения в списках покупок пользователей: {sorted(users)}'
+        )
+        if options['check']:
+            return
+        with transaction.atomic():
+            ShoppingCartIngredient.objects.rebuild(users)
+            bump_shopping_cart_version(users)
+        self.stdout.write(f'Пересчитано списков покупок: {len(users)}')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import recount_counters
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes favorites, shopping lists, recipes and subscriptions '
+        'counters of recipes and users.'
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            recount_counters()
+        self.stdout.write('Счетчики пересчитаны')
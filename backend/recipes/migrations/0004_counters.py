@@ -0,0 +1,57 @@
+# Generated by Django 3.2.12 on 2026-10-18 17:53
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_related(queryset, field):
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+                field
+            ).annotate(total=Count('pk')).values('total')
+        ),
+        0
+    )
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favorite = apps.get_model('recipes', 'Favorite')
+    ShoppingList = apps.get_model('recipes', 'ShoppingList')
+    User = apps.get_model('users', 'FoodgramUser')
+    subscriptions = User.subscribed_to.through.objects.all()
+    Recipe.objects.update(
+        favorites_count=count_related(Favorite.objects.all(), 'recipe'),
+        shopping_carts_count=count_related(
+            ShoppingList.objects.all(), 'recipe'
+        )
+    )
+    User.objects.update(
+        recipes_count=count_related(Recipe.objects.all(), 'author'),
+        followers_count=count_related(subscriptions, 'to_foodgramuser'),
+        following_count=count_related(subscriptions, 'from_foodgramuser')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_counters'),
+        ('recipes', '0003_shopping_cart_ingredient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Добавлений в избранное'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_carts_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Добавлений в список покупок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
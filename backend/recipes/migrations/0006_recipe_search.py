@@ -0,0 +1,73 @@
+from django.db import migrations
+
+# Search index is maintained by database. SQLite drops triggers when
+# a migration remakes recipes table, so such migrations must recreate them.
+
+POSTGRES_CREATE = [
+    "CREATE INDEX recipe_search_idx ON recipes_recipe USING gin (("
+    "setweight(to_tsvector('russian', name), 'A') || "
+    "setweight(to_tsvector('russian', text), 'B')))",
+]
+POSTGRES_DROP = ['DROP INDEX IF EXISTS recipe_search_idx']
+
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5("
+    "name, text, content='recipes_recipe', content_rowid='id')",
+    "CREATE TRIGGER recipes_recipe_fts_insert AFTER INSERT ON recipes_recipe "
+    "BEGIN "
+    "INSERT INTO recipes_recipe_fts(rowid, name, text) "
+    "VALUES (new.id, new.name, new.text); "
+    "END",
+    "CREATE TRIGGER recipes_recipe_fts_delete AFTER DELETE ON recipes_recipe "
+    "BEGIN "
+    "INSERT INTO recipes_recipe_fts(recipes_recipe_fts, rowid, name, text) "
+    "VALUES ('delete', old.id, old.name, old.text); "
+    "END",
+    "CREATE TRIGGER recipes_recipe_fts_update "
+    "AFTER UPDATE OF name, text ON recipes_recipe "
+    "BEGIN "
+    "INSERT INTO recipes_recipe_fts(recipes_recipe_fts, rowid, name, text) "
+    "VALUES ('delete', old.id, old.name, old.text); "
+    "INSERT INTO recipes_recipe_fts(rowid, name, text) "
+    "VALUES (new.id, new.name, new.text); "
+    "END",
+    "INSERT INTO recipes_recipe_fts(recipes_recipe_fts) VALUES ('rebuild')",
+]
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_insert',
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_delete',
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_update',
+    'DROP TABLE IF EXISTS recipes_recipe_fts',
+]
+
+STATEMENTS = {
+    'postgresql': (POSTGRES_CREATE, POSTGRES_DROP),
+    'sqlite': (SQLITE_CREATE, SQLITE_DROP),
+}
+
+
+def execute(schema_editor, create):
+    statements = STATEMENTS.get(schema_editor.connection.vendor)
+    if statements is None:
+        return
+    for sql in statements[0 if create else 1]:
+        schema_editor.execute(sql, params=None)
+
+
+def create_search_index(apps, schema_editor):
+    execute(schema_editor, create=True)
+
+
+def drop_search_index(apps, schema_editor):
+    execute(schema_editor, create=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipe_ordering_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.12 on 2026-10-18 18:11
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+search = import_module('recipes.migrations.0006_recipe_search')
+
+
+def recreate_search_index(apps, schema_editor):
+    # SQLite remakes recipes table to add a field, which drops its triggers
+    if schema_editor.connection.vendor == 'sqlite':
+        search.drop_search_index(apps, schema_editor)
+        search.create_search_index(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_search'),
+    ]
+
+    operations = [
+        # recreates index, when the field is removed
+        migrations.RunPython(migrations.RunPython.noop, recreate_search_index),
+        migrations.AddField(
+            model_name='recipe',
+            name='cache_version',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Версия рецепта'),
+        ),
+        migrations.RunPython(recreate_search_index, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,10 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import (Case, Count, F, IntegerField, OuterRef,
+                              Subquery, Sum, Value, When)
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
 
+from recipes.db import CountersMixin, insert_ignoring_conflicts
 from recipes.validators import positive_integer_validator
 
 
@@ -16,6 +20,23 @@ def get_deleted_user():
     )[0]
 
 
+def bump_shopping_cart_version(users) -> None:
+    """
+    Changes shopping cart version of given users (ids or queryset), so
+    their cached shopping lists are regenerated on next download.
+    """
+    User.objects.filter(pk__in=users).update(
+        shopping_cart_version=F('shopping_cart_version') + 1
+    )
+
+
+def change_recipes_count(author, delta: int) -> None:
+    """Changes recipes counter of author (id or instance) by delta."""
+    User.objects.filter(pk=getattr(author, 'pk', author)).update(
+        recipes_count=F('recipes_count') + delta
+    )
+
+
 def get_image_upload_path(instance, filename):
     """
     Generate path to upload recipe images.
@@ -67,7 +88,7 @@ class Ingredient(models.Model):
         return f'{self.name}, {self.measurement_unit}'
 
 
-class Recipe(models.Model):
+class Recipe(CountersMixin, models.Model):
     author = models.ForeignKey(
         User,
         on_delete=models.SET(get_deleted_user),
@@ -100,11 +121,53 @@ class Recipe(models.Model):
         verbose_name='Время приготовления (мин)',
         validators=[positive_integer_validator]
     )
+    favorites_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Добавлений в избранное'
+    )
+    shopping_carts_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Добавлений в список покупок'
+    )
+    cache_version = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Версия рецепта'
+    )
+
+    # fields, which are not saved to existing row (see CountersMixin), as
+    # recipe is changed by API and admin after being loaded
+    COUNTER_FIELDS = {'favorites_count', 'shopping_carts_count'}
 
     class Meta:
         ordering = ['-pk']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        # indexes for orderings of recipes list, alone and with author filter
+        indexes = [
+            models.Index(
+                fields=['-favorites_count', '-id'],
+                name='recipe_popular_idx'
+            ),
+            models.Index(
+                fields=['cooking_time', '-id'],
+                name='recipe_cooking_time_idx'
+            ),
+            models.Index(
+                fields=['author', '-id'],
+                name='recipe_author_newest_idx'
+            ),
+            models.Index(
+                fields=['author', '-favorites_count', '-id'],
+                name='recipe_author_popular_idx'
+            ),
+            models.Index(
+                fields=['author', 'cooking_time', '-id'],
+                name='recipe_author_cooking_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -131,6 +194,9 @@ class RecipeIngredients(models.Model):
 
 
 class UserRecipe(models.Model):
+    # recipe counter, which is maintained on adding and removing entries
+    counter_field = None
+
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -156,8 +222,78 @@ class UserRecipe(models.Model):
     def __str__(self):
         return f'Пользователь: {self.user}, рецепт: {self.recipe}'
 
+    @classmethod
+    def update_counter(cls, recipes, delta: int) -> None:
+        """Changes counter of the entries of given recipes (ids) by delta."""
+        Recipe.objects.filter(pk__in=recipes).update(
+            **{cls.counter_field: F(cls.counter_field) + delta}
+        )
+
+    @classmethod
+    def add(cls, user, recipe) -> int:
+        """
+        Creates user-recipe entry, unless it exists, returns number of
+        created entries. Entry is inserted with a single INSERT, which
+        ignores unique constraint conflicts, so concurrent requests can't
+        create the same entry twice.
+        """
+        if not insert_ignoring_conflicts(
+            cls, ('user', 'recipe'), [(user.pk, recipe.pk)]
+        ):
+            return 0
+        cls.update_counter([recipe.pk], 1)
+        return 1
+
+    @classmethod
+    def remove(cls, user, recipe) -> int:
+        """Removes user-recipe entry, returns number of deleted entries."""
+        if not cls.objects.filter(user=user, recipe=recipe).delete()[0]:
+            return 0
+        cls.update_counter([recipe.pk], -1)
+        return 1
+
+    @classmethod
+    def add_many(cls, user, recipes) -> set:
+        """
+        Creates user-recipe entries for given recipes (ids), which are not
+        added yet, returns ids of created entries. Only entries inserted by
+        this call are counted, entries created concurrently are skipped.
+        """
+        if not recipes:
+            return set()
+        with transaction.atomic():
+            added = insert_ignoring_conflicts(
+                cls,
+                ('user', 'recipe'),
+                [(user.pk, recipe) for recipe in recipes],
+                returning='recipe'
+            )
+            if added:
+                cls.update_counter(added, 1)
+        return added
+
+    @classmethod
+    def remove_many(cls, user, recipes) -> set:
+        """
+        Removes user-recipe entries of given recipes (ids), returns ids of
+        removed entries. Entries are locked until removed with a single
+        DELETE, so concurrent removals are not counted twice.
+        """
+        with transaction.atomic():
+            removed = set(
+                cls.objects.select_for_update().filter(
+                    user=user, recipe__in=recipes
+                ).values_list('recipe', flat=True)
+            )
+            if not removed:
+                return removed
+            cls.objects.filter(user=user, recipe__in=removed).delete()
+            cls.update_counter(removed, -1)
+        return removed
+
 
 class Favorite(UserRecipe):
+    counter_field = 'favorites_count'
 
     class Meta(UserRecipe.Meta):
         verbose_name = 'Избранный рецепт'
@@ -165,7 +301,225 @@ class Favorite(UserRecipe):
 
 
 class ShoppingList(UserRecipe):
+    counter_field = 'shopping_carts_count'
 
     class Meta(UserRecipe.Meta):
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Списки покупок'
+
+    @classmethod
+    def add(cls, user, recipe) -> int:
+        if not super().add(user, recipe):
+            return 0
+        ShoppingCartIngredient.objects.add_amounts(
+            [user.pk], get_ingredient_amounts(recipe)
+        )
+        bump_shopping_cart_version([user.pk])
+        return 1
+
+    @classmethod
+    def remove(cls, user, recipe) -> int:
+        if not super().remove(user, recipe):
+            return 0
+        ShoppingCartIngredient.objects.add_amounts(
+            [user.pk],
+            {
+                ingredient: -amount
+                for ingredient, amount
+                in get_ingredient_amounts(recipe).items()
+            }
+        )
+        bump_shopping_cart_version([user.pk])
+        return 1
+
+    @classmethod
+    def add_many(cls, user, recipes) -> set:
+        with transaction.atomic():
+            added = super().add_many(user, recipes)
+            if added:
+                ShoppingCartIngredient.objects.add_amounts(
+                    [user.pk], get_ingredient_amounts(added)
+                )
+                bump_shopping_cart_version([user.pk])
+        return added
+
+    @classmethod
+    def remove_many(cls, user, recipes) -> set:
+        with transaction.atomic():
+            removed = super().remove_many(user, recipes)
+            if removed:
+                ShoppingCartIngredient.objects.add_amounts(
+                    [user.pk],
+                    {
+                        ingredient: -amount
+                        for ingredient, amount
+                        in get_ingredient_amounts(removed).items()
+                    }
+                )
+                bump_shopping_cart_version([user.pk])
+        return removed
+
+
+class ShoppingCartIngredientQuerySet(models.QuerySet):
+
+    def add_amounts(self, users, amounts: dict) -> None:
+        """
+        Adds amounts of ingredients, e.g. {<ingredient_id>: <amount>}, to
+        shopping carts of given users (list of ids). Amounts can be negative.
+        Totals are changed with a single UPDATE, so concurrent changes of the
+        same cart are not lost. Entries with zero amount are kept and
+        skipped on read.
+        """
+        amounts = {
+            ingredient: amount
+            for ingredient, amount in amounts.items() if amount
+        }
+        if not users or not amounts:
+            return
+        self.bulk_create(
+            [
+                self.model(user_id=user, ingredient_id=ingredient, amount=0)
+                for user in users for ingredient in amounts
+            ],
+            ignore_conflicts=True
+        )
+        self.filter(user__in=users, ingredient__in=amounts).update(
+            amount=F('amount') + Case(
+                *[
+                    When(ingredient=ingredient, then=Value(amount))
+                    for ingredient, amount in amounts.items()
+                ],
+                output_field=IntegerField()
+            )
+        )
+
+    def rebuild(self, users=None) -> None:
+        """Recomputes shopping carts of given users (all users, if None)
+        from their shopping lists."""
+        entries = self.all()
+        source = RecipeIngredients.objects.filter(
+            recipe__shoppinglist_recipes__isnull=False
+        )
+        if users is not None:
+            entries = entries.filter(user__in=users)
+            source = RecipeIngredients.objects.filter(
+                recipe__shoppinglist_recipes__user__in=users
+            )
+        entries.delete()
+        self.bulk_create(
+            (
+                self.model(
+                    user_id=entry['user'],
+                    ingredient_id=entry['ingredient'],
+                    amount=entry['total']
+                )
+                for entry in source.values(
+                    'ingredient', user=F('recipe__shoppinglist_recipes__user')
+                ).annotate(total=Sum('amount')).iterator()
+            ),
+            batch_size=1000
+        )
+
+
+class ShoppingCartIngredient(models.Model):
+    """
+    Total amount of ingredient in user's shopping cart. Maintained on every
+    change of user's shopping list and of recipes ingredients, so shopping
+    list is read without aggregating all recipes in cart.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='shopping_cart_ingredients'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент'
+    )
+    amount = models.IntegerField(
+        verbose_name='Количество'
+    )
+
+    objects = ShoppingCartIngredientQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Ингредиенты в списках покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_cart_ingredient')
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} - {self.amount}'
+
+
+def get_ingredient_amounts(recipes) -> dict:
+    """
+    Returns amounts of ingredients of recipe (instance or id) or total
+    amounts of ingredients of several recipes (ids or queryset),
+    e.g. {<ingredient_id>: 10}.
+    """
+    if isinstance(recipes, (Recipe, int)):
+        recipes = [recipes]
+    return dict(
+        RecipeIngredients.objects.filter(recipe__in=recipes).values(
+            'ingredient'
+        ).annotate(total=Sum('amount')).values_list('ingredient', 'total')
+    )
+
+
+def update_shopping_carts(recipe, old_amounts: dict, new_amounts: dict):
+    """
+    Applies change of recipe ingredients amounts to shopping carts of users,
+    who have the recipe in their shopping list.
+    """
+    users = list(
+        ShoppingList.objects.filter(recipe=recipe).values_list(
+            'user', flat=True
+        )
+    )
+    if not users:
+        return
+    ShoppingCartIngredient.objects.add_amounts(
+        users,
+        {
+            ingredient: (
+                new_amounts.get(ingredient, 0) - old_amounts.get(ingredient, 0)
+            )
+            for ingredient in {*old_amounts, *new_amounts}
+        }
+    )
+    bump_shopping_cart_version(users)
+
+
+def count_related(queryset, field):
+    """Returns expression, counting entries of queryset related by field."""
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+                field
+            ).annotate(total=Count('pk')).values('total')
+        ),
+        0
+    )
+
+
+def recount_counters() -> None:
+    """Recomputes denormalized counters of recipes and users from
+    favorites, shopping lists, recipes and subscriptions."""
+    subscriptions = User.subscribed_to.through.objects.all()
+    Recipe.objects.update(
+        favorites_count=count_related(Favorite.objects.all(), 'recipe'),
+        shopping_carts_count=count_related(
+            ShoppingList.objects.all(), 'recipe'
+        )
+    )
+    User.objects.update(
+        recipes_count=count_related(Recipe.objects.all(), 'author'),
+        followers_count=count_related(subscriptions, 'to_foodgramuser'),
+        following_count=count_related(subscriptions, 'from_foodgramuser')
+    )
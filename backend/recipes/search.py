@@ -0,0 +1,73 @@
+"""
+Full-text search of recipes by name and text. Search index is maintained
+by database: GIN expression index with russian stemming on PostgreSQL and
+FTS5 table, kept in sync by triggers, on SQLite (see migration
+0006_recipe_search). Other databases fall back to substring search.
+"""
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+# must match expression of `recipe_search_idx` index
+POSTGRES_SEARCH_VECTOR = (
+    "(setweight(to_tsvector('russian', \"recipes_recipe\".\"name\"), 'A') || "
+    "setweight(to_tsvector('russian', \"recipes_recipe\".\"text\"), 'B'))"
+)
+POSTGRES_SEARCH_QUERY = "websearch_to_tsquery('russian', %s)"
+
+SQLITE_SEARCH_TABLE = 'recipes_recipe_fts'
+# matches in recipe name are ten times more relevant, than in its text
+SQLITE_SEARCH_RANK = f'-bm25({SQLITE_SEARCH_TABLE}, 10.0, 1.0)'
+
+
+def search_postgres(queryset, query):
+    return queryset.filter(
+        RawSQL(
+            f'{POSTGRES_SEARCH_VECTOR} @@ {POSTGRES_SEARCH_QUERY}',
+            (query, ),
+            output_field=BooleanField()
+        )
+    ).annotate(
+        search_rank=RawSQL(
+            f'ts_rank({POSTGRES_SEARCH_VECTOR}, {POSTGRES_SEARCH_QUERY})',
+            (query, ),
+            output_field=FloatField()
+        )
+    )
+
+
+def search_sqlite(queryset, query):
+    # every word is matched as a prefix, which partly makes up for missing
+    # stemming
+    words = re.findall(r'\w+', query)
+    if not words:
+        return queryset.none()
+    match = ' '.join(f'"{word}"*' for word in words)
+    # FTS table is joined, so relevance is computed in the same pass; unary
+    # plus prevents rowid lookups in FTS table, so the match drives the join
+    return queryset.extra(
+        tables=[SQLITE_SEARCH_TABLE],
+        where=[
+            f'+{SQLITE_SEARCH_TABLE}.rowid = "recipes_recipe"."id"',
+            f'{SQLITE_SEARCH_TABLE} MATCH %s'
+        ],
+        params=[match]
+    ).annotate(
+        search_rank=RawSQL(SQLITE_SEARCH_RANK, (), output_field=FloatField())
+    )
+
+
+def search_recipes(queryset, query):
+    """Filters recipes queryset by search query, most relevant first."""
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        queryset = search_postgres(queryset, query)
+    elif vendor == 'sqlite':
+        queryset = search_sqlite(queryset, query)
+    else:
+        queryset = queryset.filter(
+            Q(name__icontains=query) | Q(text__icontains=query)
+        ).annotate(search_rank=Value(0.0, output_field=FloatField()))
+    return queryset.order_by('-search_rank', '-pk')
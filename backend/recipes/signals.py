@@ -0,0 +1,41 @@
+from django.db.models import F
+from django.db.models.signals import pre_delete
+from django.dispatch import Signal, receiver
+
+from recipes.models import (Favorite, Recipe, ShoppingList, User,
+                            change_recipes_count, get_deleted_user,
+                            get_ingredient_amounts, update_shopping_carts)
+
+# Sent with changed model (Ingredient or Tag) as sender, when catalog rows
+# are changed in bulk, so model signals are not sent for every row.
+catalog_changed = Signal()
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_from_shopping_carts(sender, instance, **kwargs):
+    # shopping list entries are deleted with the recipe, so its ingredients
+    # are subtracted from carts on every delete path (API, admin, cascade)
+    update_shopping_carts(instance, get_ingredient_amounts(instance), {})
+
+
+@receiver(pre_delete, sender=User)
+def remove_user_from_counters(sender, instance, **kwargs):
+    # favorites, shopping lists and subscriptions of the user are deleted by
+    # cascade, so counters of recipes and other users are decremented here
+    for model in (Favorite, ShoppingList):
+        model.update_counter(
+            model.objects.filter(user=instance).values_list(
+                'recipe', flat=True
+            ), -1
+        )
+    User.objects.filter(subscribed_by=instance).update(
+        followers_count=F('followers_count') - 1
+    )
+    User.objects.filter(subscribed_to=instance).update(
+        following_count=F('following_count') - 1
+    )
+    # recipes of the user are passed to `deleted` user
+    instance.recipes.update(cache_version=F('cache_version') + 1)
+    recipes_count = instance.recipes.count()
+    if recipes_count and instance.username != 'deleted':
+        change_recipes_count(get_deleted_user(), recipes_count)
@@ -1,6 +1,29 @@
 import pytest
 
-from recipes.models import Tag, Ingredient, Recipe, ShoppingList
+from django.core.cache import caches
+
+from api.authentication import token_user_cache
+from api.autocomplete import ingredient_index
+from api.catalog import catalog_bundle
+from api.filters import tag_slugs_cache
+from recipes.models import (Tag, Ingredient, Recipe, ShoppingList,
+                            recount_counters)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    for cache in caches.all():
+        cache.clear()
+    tag_slugs_cache.clear()
+    ingredient_index.clear()
+    catalog_bundle.clear()
+    token_user_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def media_root(settings, tmp_path):
+    # uploaded recipe images are not left in project media folder
+    settings.MEDIA_ROOT = tmp_path / 'media'
 
 
 @pytest.fixture
@@ -43,6 +66,16 @@ def authorized_client_1(test_user_1):
     return client
 
 
+@pytest.fixture
+def authorized_client_2(test_user_2):
+    from rest_framework.authtoken.models import Token
+    from rest_framework.test import APIClient
+    token = Token.objects.get_or_create(user=test_user_2)[0]
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+    return client
+
+
 @pytest.fixture
 def test_tags():
     Tag.objects.create(name='Тег 1', color='#a9d27d', slug='tag_color')
@@ -86,6 +119,7 @@ def test_recipes(test_tags, test_ingredients, test_user_1, test_user_2):
     recipe2.ingredients.add(
         *less_ingredients, through_defaults={'amount': 2}
     )
+    recount_counters()
 
     return Recipe.objects.all()
 
@@ -107,12 +141,6 @@ def valid_recipe_data(test_ingredients, test_tags):
 
 @pytest.fixture
 def shopping_list_recipes(test_recipes, test_user_1):
-    ShoppingList.objects.create(
-        user=test_user_1,
-        recipe=test_recipes[0]
-    )
-    ShoppingList.objects.create(
-        user=test_user_1,
-        recipe=test_recipes[1]
-    )
+    ShoppingList.add(test_user_1, test_recipes[0])
+    ShoppingList.add(test_user_1, test_recipes[1])
     return Recipe.objects.all()
@@ -2,6 +2,7 @@ import pytest
 
 from django.contrib.auth import get_user_model
 
+from api.authentication import token_user_cache
 from api.serializers import UserSerializer
 
 
@@ -206,6 +207,35 @@ def test_user_change_passwd_with_valid_data(authorized_client_1, test_user_1):
     assert response.data is None
 
 
+@pytest.mark.django_db(transaction=True)
+def test_user_change_password_keeps_counters(authorized_client_1,
+                                             test_user_1,
+                                             test_user_2,
+                                             test_recipes):
+    test_user_1.set_password('SomePassword123')
+    test_user_1.save()
+    # request user is cached with counters, which are changed below
+    authorized_client_1.get(CURRENT_USER_ENDPOINT)
+    authorized_client_1.post(
+        f'/api/recipes/{test_recipes[1].pk}/shopping_cart/'
+    )
+    authorized_client_1.post(
+        f'{API_USERS_ENDPOINT}{test_user_2.pk}/subscribe/'
+    )
+    response = authorized_client_1.post(
+        CHANGE_PASSWORD_ENDPOINT,
+        {'new_password': 'NewPassword123',
+         'current_password': 'SomePassword123'}
+    )
+    assert response.status_code == 204
+
+    test_user_1.refresh_from_db()
+    assert test_user_1.check_password('NewPassword123')
+    assert test_user_1.shopping_cart_version == 1
+    assert test_user_1.following_count == 1
+    assert User.objects.get(pk=test_user_2.pk).followers_count == 1
+
+
 @pytest.mark.django_db(transaction=True)
 def test_user_change_password_invalid_data(authorized_client_1, test_user_1):
     payload_invalid_old_password = {
@@ -282,3 +312,129 @@ def test_users_delete_token_unauthorized_client(guest_client):
     response = guest_client.post(DELETE_TOKEN_ENDPOINT)
     assert response.status_code != 404
     assert response.status_code == 401
+
+
+def create_users(django_user_model, count):
+    return django_user_model.objects.bulk_create(
+        django_user_model(
+            email=f'user{i}@example.com',
+            username=f'user{i}',
+            first_name='Имя',
+            last_name=f'Фамилия {i}'
+        )
+        for i in range(count)
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+def test_subscriptions_loaded_once_per_request(authorized_client_1,
+                                               test_user_1,
+                                               django_user_model,
+                                               django_assert_num_queries):
+    create_users(django_user_model, 10)
+    subscribed = django_user_model.objects.filter(username__in=[
+        'user1', 'user5'
+    ])
+    test_user_1.subscribed_to.add(*subscribed)
+
+    # token, subscriptions
+    with django_assert_num_queries(2):
+        response = authorized_client_1.get(CURRENT_USER_ENDPOINT)
+    assert response.status_code == 200
+    assert response.json()['is_subscribed'] is False
+
+    # user is taken from token cache, user with annotated subscription
+    with django_assert_num_queries(1):
+        response = authorized_client_1.get(
+            API_USERS_ENDPOINT + f'{subscribed[0].pk}/'
+        )
+    assert response.status_code == 200
+    assert response.json()['is_subscribed'] is True
+
+
+@pytest.mark.parametrize('limit', [6, 100])
+@pytest.mark.django_db(transaction=True)
+def test_users_list_query_count(guest_client,
+                                authorized_client_1,
+                                test_user_1,
+                                django_user_model,
+                                django_assert_num_queries,
+                                limit):
+    create_users(django_user_model, 120)
+    subscribed = django_user_model.objects.filter(username__in=[
+        'user1', 'user5'
+    ])
+    test_user_1.subscribed_to.add(*subscribed)
+    endpoint = API_USERS_ENDPOINT + f'?limit={limit}'
+
+    # count, users
+    with django_assert_num_queries(2):
+        response = guest_client.get(endpoint)
+    assert response.status_code == 200
+    assert len(response.json()['results']) == limit
+
+    # token, count, users
+    with django_assert_num_queries(3):
+        response = authorized_client_1.get(endpoint)
+    assert response.status_code == 200
+    results = response.json()['results']
+    assert len(results) == limit
+    assert {
+        user['username'] for user in results if user['is_subscribed']
+    } == {'user1', 'user5'} & {user['username'] for user in results}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_cached_token_authentication(authorized_client_1,
+                                     test_user_1,
+                                     django_assert_num_queries):
+    assert authorized_client_1.get(CURRENT_USER_ENDPOINT).status_code == 200
+    # only subscriptions are loaded, user is taken from token cache
+    with django_assert_num_queries(1):
+        response = authorized_client_1.get(CURRENT_USER_ENDPOINT)
+    assert response.json()['email'] == test_user_1.email
+
+    # changes of user are seen at once
+    test_user_1.first_name = 'Новое имя'
+    test_user_1.save()
+    response = authorized_client_1.get(CURRENT_USER_ENDPOINT)
+    assert response.json()['first_name'] == 'Новое имя'
+
+    test_user_1.is_active = False
+    test_user_1.save()
+    assert authorized_client_1.get(CURRENT_USER_ENDPOINT).status_code == 401
+    test_user_1.is_active = True
+    test_user_1.save()
+    assert authorized_client_1.get(CURRENT_USER_ENDPOINT).status_code == 200
+
+    response = authorized_client_1.post(DELETE_TOKEN_ENDPOINT)
+    assert response.status_code == 204
+    assert authorized_client_1.get(CURRENT_USER_ENDPOINT).status_code == 401
+
+
+@pytest.mark.django_db(transaction=True)
+def test_api_requests_skip_session_middleware(authorized_client_1, client):
+    response = authorized_client_1.get(CURRENT_USER_ENDPOINT)
+    assert response.status_code == 200
+    assert not hasattr(response.wsgi_request, 'session')
+    assert 'X-Frame-Options' in response
+
+    # admin keeps sessions, CSRF protection and messages
+    response = client.get('/admin/login/')
+    assert response.status_code == 200
+    assert hasattr(response.wsgi_request, 'session')
+    assert hasattr(response.wsgi_request, '_messages')
+    assert 'csrftoken' in response.cookies
+
+
+def test_token_cache_timeout(settings):
+    # in-process cache can't be invalidated by other processes
+    assert token_user_cache.timeout == settings.TOKEN_CACHE_LOCAL_TIMEOUT
+    settings.CACHES = {
+        **settings.CACHES,
+        'tokens': {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache'
+        }
+    }
+    settings.TOKEN_CACHE_ALIAS = 'tokens'
+    assert token_user_cache.timeout == settings.TOKEN_CACHE_TIMEOUT
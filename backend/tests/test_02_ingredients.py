@@ -1,6 +1,12 @@
+import gzip
+import json
+
 import pytest
 
 from recipes.models import Ingredient
+from recipes.signals import catalog_changed
+from api.autocomplete import IngredientIndex, ingredient_index
+from api.catalog import CatalogBundle, catalog_bundle
 from api.serializers import IngredientSerializer
 
 
@@ -71,3 +77,150 @@ def test_filter_ingredients_by_name(guest_client):
 
     response = guest_client.get('/api/ingredients/?name=ugar')
     assert len(response.data) == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_ingredients_autocomplete(guest_client, django_assert_num_queries):
+    for name in ('Сахарная пудра', 'Ванильный сахар', 'сахар', 'Соль'):
+        Ingredient.objects.create(name=name, measurement_unit='г')
+    endpoint = '/api/ingredients/?name=САХАР'
+
+    # prefix matches go first, then substring matches
+    response = guest_client.get(endpoint)
+    assert response.status_code == 200
+    assert [item['name'] for item in response.json()] == [
+        'сахар', 'Сахарная пудра', 'Ванильный сахар'
+    ]
+    assert set(response.json()[0]) == {'id', 'name', 'measurement_unit'}
+
+    # index is built once
+    with django_assert_num_queries(0):
+        response = guest_client.get(endpoint + '&limit=2')
+    assert [item['name'] for item in response.json()] == [
+        'сахар', 'Сахарная пудра'
+    ]
+
+    response = guest_client.get('/api/ingredients/?name=сохар')
+    assert response.json() == []
+    response = guest_client.get('/api/ingredients/?name=сохар&fuzzy=1')
+    assert response.json()[0]['name'] == 'сахар'
+
+    # index is rebuilt after ingredients change
+    Ingredient.objects.create(name='Сахарин', measurement_unit='г')
+    response = guest_client.get(endpoint)
+    assert 'Сахарин' in [item['name'] for item in response.json()]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_ingredients_index_rebuilt_after_import(guest_client):
+    response = guest_client.get('/api/ingredients/?name=соль')
+    assert response.json() == []
+
+    Ingredient.objects.bulk_create(
+        [Ingredient(name='соль', measurement_unit='г')]
+    )
+    catalog_changed.send(sender=Ingredient)
+    response = guest_client.get('/api/ingredients/?name=соль')
+    assert len(response.json()) == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_catalog_bundle(guest_client,
+                        test_ingredients,
+                        test_tags,
+                        django_assert_num_queries):
+    response = guest_client.get('/api/catalog/')
+    assert response.status_code == 200
+    assert 'no-cache' in response['Cache-Control']
+    data = json.loads(response.content)
+    assert data['ingredients'] == IngredientSerializer(
+        test_ingredients.order_by('pk'), many=True
+    ).data
+    assert len(data['tags']) == len(test_tags)
+    etag = response['ETag']
+    versioned_endpoint = response['Content-Location']
+
+    # bundle is built once
+    with django_assert_num_queries(0):
+        response = guest_client.get(
+            '/api/catalog/', HTTP_IF_NONE_MATCH=etag
+        )
+        assert response.status_code == 304
+
+        response = guest_client.get(
+            versioned_endpoint, HTTP_ACCEPT_ENCODING='gzip, deflate'
+        )
+    assert response.status_code == 200
+    assert response['Content-Encoding'] == 'gzip'
+    assert 'immutable' in response['Cache-Control']
+    assert json.loads(gzip.decompress(response.content)) == data
+
+    # new bundle version after catalog change
+    Ingredient.objects.bulk_create(
+        [Ingredient(name='соль', measurement_unit='г')]
+    )
+    catalog_changed.send(sender=Ingredient)
+    response = guest_client.get('/api/catalog/', HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert len(json.loads(response.content)['ingredients']) == len(
+        test_ingredients
+    )
+    assert response['Content-Location'] != versioned_endpoint
+    assert guest_client.get(versioned_endpoint).status_code == 404
+
+    etag = response['ETag']
+    test_tags[0].delete()
+    response = guest_client.get('/api/catalog/', HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db(transaction=True)
+def test_catalog_changed_by_other_process(guest_client,
+                                          test_ingredients,
+                                          test_tags,
+                                          settings):
+    # snapshots of other process, which share change stamps with this one
+    other_bundle, other_index = CatalogBundle(), IngredientIndex()
+    response = guest_client.get('/api/catalog/')
+    versioned_endpoint = response['Content-Location']
+    assert len(ingredient_index.search('соль')) == 0
+
+    # change is made by other process, timeouts don't expire
+    settings.CATALOG_BUNDLE_TIMEOUT = settings.INGREDIENT_INDEX_TIMEOUT = 3600
+    Ingredient.objects.bulk_create(
+        [Ingredient(name='соль', measurement_unit='г')]
+    )
+    other_bundle.changed()
+    other_index.changed()
+    response = guest_client.get('/api/catalog/')
+    assert response['Content-Location'] != versioned_endpoint
+    assert len(json.loads(response.content)['ingredients']) == len(
+        test_ingredients
+    )
+    assert len(ingredient_index.search('соль')) == 1
+    assert guest_client.get(versioned_endpoint).status_code == 404
+
+
+@pytest.mark.django_db(transaction=True)
+def test_catalog_version_of_other_process(guest_client,
+                                          test_ingredients,
+                                          test_tags,
+                                          django_assert_num_queries,
+                                          monkeypatch):
+    catalog_bundle.get_snapshot()
+    # other process has built bundle from newer data, but change stamp of
+    # this process was not replaced (not shared cache)
+    Ingredient.objects.bulk_create(
+        [Ingredient(name='соль', measurement_unit='г')]
+    )
+    version = CatalogBundle().build().version
+
+    # bundle is not rebuilt more often than once in refresh interval
+    with django_assert_num_queries(0):
+        response = guest_client.get(f'/api/catalog/{version}/')
+    assert response.status_code == 404
+
+    monkeypatch.setattr(CatalogBundle, 'refresh_interval', 0)
+    response = guest_client.get(f'/api/catalog/{version}/')
+    assert response.status_code == 200
+    assert response['Content-Location'].endswith(f'/{version}/')
@@ -1,7 +1,12 @@
 import pytest
+from django.db import connection
+from django.http import QueryDict
+from django.test.utils import CaptureQueriesContext
 
-from recipes.models import Favorite, Recipe, ShoppingList
-from api.serializers import RecipeSerializer
+from api.catalog import catalog_bundle
+from api.filters import RecipeFilter
+from recipes.models import Favorite, Recipe, RecipeIngredients, ShoppingList
+from api.serializers import RecipeSerializer, RecipeWriteSerializer
 
 RECIPES_ENDPOINT = '/api/recipes/'
 
@@ -73,6 +78,68 @@ def test_recipes_pagination(guest_client, test_recipes):
     assert test_recipes[1].name in data['results'][0].values()
 
 
+def test_recipes_cursor_pagination(guest_client,
+                                   test_user_2,
+                                   test_tags,
+                                   test_ingredients,
+                                   django_assert_num_queries):
+    create_recipes(test_user_2, test_tags, test_ingredients, 10)
+    catalog_bundle.get_snapshot()
+    endpoint = RECIPES_ENDPOINT + '?limit=4&cursor='
+    recipe_ids = []
+    while endpoint:
+        # no count query
+        with django_assert_num_queries(RECIPES_LIST_QUERIES - 1):
+            response = guest_client.get(endpoint)
+        assert response.status_code == 200
+        data = response.json()
+        assert 'count' not in data
+        recipe_ids += [recipe['id'] for recipe in data['results']]
+        endpoint = data['next']
+
+    assert recipe_ids == list(Recipe.objects.values_list('id', flat=True))
+
+    response = guest_client.get(RECIPES_ENDPOINT + '?limit=4')
+    assert response.json()['count'] == 10
+
+
+@pytest.mark.parametrize('ordering', ['popular', 'cooking_time'])
+def test_recipes_cursor_pagination_with_ordering(guest_client,
+                                                 test_user_2,
+                                                 test_tags,
+                                                 test_ingredients,
+                                                 ordering):
+    create_recipes(test_user_2, test_tags, test_ingredients, 10)
+    # leading ordering field has repeated values
+    Recipe.objects.filter(pk__in=Recipe.objects.all()[:6]).update(
+        favorites_count=1, cooking_time=1
+    )
+    endpoint = RECIPES_ENDPOINT + f'?ordering={ordering}&limit=3&cursor='
+    pages = []
+    with CaptureQueriesContext(connection) as queries:
+        while endpoint:
+            data = guest_client.get(endpoint).json()
+            pages.append([recipe['id'] for recipe in data['results']])
+            endpoint = data['next']
+    # pages are selected by position, not by offset
+    assert not any('OFFSET' in query['sql'] for query in queries)
+
+    response = guest_client.get(
+        RECIPES_ENDPOINT + f'?ordering={ordering}&limit=10'
+    )
+    expected = [recipe['id'] for recipe in response.json()['results']]
+    assert sum(pages, []) == expected
+
+    # previous links lead back through the same pages
+    previous_pages = [pages[-1]]
+    endpoint = data['previous']
+    while endpoint:
+        data = guest_client.get(endpoint).json()
+        previous_pages.insert(0, [recipe['id'] for recipe in data['results']])
+        endpoint = data['previous']
+    assert previous_pages == pages
+
+
 def test_get_recipes_with_filter_favorites(authorized_client_1,
                                            test_user_1,
                                            test_recipes):
@@ -105,6 +172,44 @@ def test_get_recipes_with_filter_shopping_list(authorized_client_1,
     assert data['results'][0]['id'] == test_recipes[0].id
 
 
+@pytest.mark.django_db(transaction=True)
+def test_user_recipes_filters(authorized_client_1,
+                              guest_client,
+                              test_user_1,
+                              test_recipes):
+    Favorite.objects.create(user=test_user_1, recipe=test_recipes[0])
+    ShoppingList.objects.create(user=test_user_1, recipe=test_recipes[1])
+    for param, recipe in (('is_favorited', test_recipes[1]),
+                          ('is_in_shopping_cart', test_recipes[0])):
+        response = authorized_client_1.get(RECIPES_ENDPOINT + f'?{param}=0')
+        assert [item['id'] for item in response.json()['results']] == [
+            recipe.pk
+        ]
+
+        response = guest_client.get(RECIPES_ENDPOINT + f'?{param}=1')
+        assert response.status_code == 200
+        assert response.json()['count'] == 0
+
+        response = guest_client.get(RECIPES_ENDPOINT + f'?{param}=0')
+        assert response.json()['count'] == len(test_recipes)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_guest_recipes_list_without_user_subqueries(guest_client,
+                                                    test_recipes):
+    with CaptureQueriesContext(connection) as queries:
+        response = guest_client.get(RECIPES_ENDPOINT)
+    assert all(
+        not recipe['is_favorited'] and not recipe['is_in_shopping_cart']
+        for recipe in response.json()['results']
+    )
+    assert not any(
+        'recipes_favorite' in query['sql']
+        or 'recipes_shoppinglist' in query['sql']
+        for query in queries.captured_queries
+    )
+
+
 def test_get_recipes_with_filter_by_author(authorized_client_1,
                                            test_user_1,
                                            test_user_2,
@@ -164,6 +269,135 @@ def test_get_recipes_with_filter_by_tags(authorized_client_1,
     assert response.json()['count'] == 2
 
 
+@pytest.mark.django_db(transaction=True)
+def test_get_recipes_with_filter_by_all_tags(authorized_client_1,
+                                             test_tags,
+                                             test_recipes):
+    test_recipes[1].tags.set(test_tags[:1])
+    endpoint = (
+        RECIPES_ENDPOINT + f'?tags={test_tags[0].slug}&tags={test_tags[1].slug}'  # noqa E501
+    )
+
+    response = authorized_client_1.get(endpoint)
+    assert [recipe['id'] for recipe in response.json()['results']] == [
+        recipe.pk for recipe in test_recipes
+    ]
+
+    response = authorized_client_1.get(endpoint + '&tags_match=all')
+    assert response.status_code == 200
+    assert [recipe['id'] for recipe in response.json()['results']] == [
+        test_recipes[0].pk
+    ]
+
+    response = authorized_client_1.get(endpoint + '&tags=unknown')
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db(transaction=True)
+def test_tags_filter_plan(test_tags, test_recipes, django_assert_num_queries):
+    slugs = [tag.slug for tag in test_tags]
+    recipes_count = len(test_recipes)
+    for tags_match in ('any', 'all'):
+        recipes = RecipeFilter(
+            QueryDict(
+                '&'.join(f'tags={slug}' for slug in slugs)
+                + f'&tags_match={tags_match}'
+            ),
+            Recipe.objects.all()
+        ).qs
+        # tags are resolved from in-process cache
+        with django_assert_num_queries(1):
+            assert len(recipes) == recipes_count
+        assert 'DISTINCT' not in str(recipes.query)
+        assert 'SCAN recipes_recipe_tags' not in recipes.explain()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_get_recipes_with_ordering(authorized_client_1,
+                                   test_user_1,
+                                   test_tags,
+                                   test_ingredients):
+    create_recipes(test_user_1, test_tags, test_ingredients, 4)
+    recipes = list(Recipe.objects.order_by('pk'))
+    for favorites_count, recipe in zip([1, 5, 5, 0], recipes):
+        recipe.favorites_count = favorites_count
+    Recipe.objects.bulk_update(recipes, ['favorites_count'])
+    expected = {
+        'popular': [recipes[2], recipes[1], recipes[0], recipes[3]],
+        'cooking_time': recipes,
+        'newest': recipes[::-1],
+    }
+    for ordering, ordered_recipes in expected.items():
+        response = authorized_client_1.get(
+            RECIPES_ENDPOINT + f'?ordering={ordering}'
+        )
+        assert response.status_code == 200
+        assert [recipe['id'] for recipe in response.json()['results']] == [
+            recipe.pk for recipe in ordered_recipes
+        ]
+
+    # ordering is combined with filters
+    response = authorized_client_1.get(
+        RECIPES_ENDPOINT + f'?ordering=popular&author={test_user_1.pk}'
+        f'&tags={test_tags[0].slug}'
+    )
+    assert response.json()['results'][0]['id'] == recipes[2].pk
+
+    response = authorized_client_1.get(RECIPES_ENDPOINT + '?ordering=name')
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db(transaction=True)
+def test_search_recipes(authorized_client_1,
+                        test_user_1,
+                        test_recipes,
+                        valid_recipe_data):
+    recipe_1, recipe_2 = test_recipes.order_by('pk')
+    recipe_1.text = 'Рецепт пирога с капустой'
+    recipe_1.save()
+    recipe_2.name = 'Пирог с яблоками'
+    recipe_2.save()
+
+    # matches in name rank higher, words are matched by prefix
+    response = authorized_client_1.get(RECIPES_ENDPOINT + '?search=пирог')
+    assert response.status_code == 200
+    assert [recipe['id'] for recipe in response.json()['results']] == [
+        recipe_2.pk, recipe_1.pk
+    ]
+
+    response = authorized_client_1.get(
+        RECIPES_ENDPOINT + '?search=пирог яблок'
+    )
+    assert [recipe['id'] for recipe in response.json()['results']] == [
+        recipe_2.pk
+    ]
+
+    # search is combined with filters
+    Favorite.objects.create(user=test_user_1, recipe=recipe_1)
+    response = authorized_client_1.get(
+        RECIPES_ENDPOINT + '?search=пирог&is_favorited=1'
+        f'&author={test_user_1.pk}'
+    )
+    assert [recipe['id'] for recipe in response.json()['results']] == [
+        recipe_1.pk
+    ]
+
+    # index follows recipes changes
+    response = authorized_client_1.patch(
+        RECIPES_ENDPOINT + f'{recipe_1.pk}/',
+        {**valid_recipe_data, 'text': 'Суп'},
+        format='json'
+    )
+    assert response.status_code == 200
+    recipe_2.delete()
+    response = authorized_client_1.get(RECIPES_ENDPOINT + '?search=пирог')
+    assert response.json()['count'] == 0
+    response = authorized_client_1.get(RECIPES_ENDPOINT + '?search=суп')
+    assert [recipe['id'] for recipe in response.json()['results']] == [
+        recipe_1.pk
+    ]
+
+
 @pytest.mark.django_db(transaction=True)
 def test_create_recipe_empty_data(authorized_client_1, valid_recipe_data):
     response = authorized_client_1.post(RECIPES_ENDPOINT)
@@ -231,6 +465,27 @@ def test_create_recipe_unexisted_ingredients(authorized_client_1,
     assert not Recipe.objects.all().exists()
 
 
+@pytest.mark.django_db(transaction=True)
+def test_create_recipe_errors_reported_per_item(authorized_client_1,
+                                                test_ingredients,
+                                                valid_recipe_data):
+    valid_recipe_data['ingredients'] += [
+        {'id': 123, 'amount': 5},
+        {'id': test_ingredients[0].pk, 'amount': 1}
+    ]
+    valid_recipe_data['tags'].append(123)
+    response = authorized_client_1.post(
+        RECIPES_ENDPOINT, valid_recipe_data, format='json')
+    assert response.status_code == 400
+
+    errors = response.json()
+    assert not any(errors['ingredients'][:2])
+    assert 'id' in errors['ingredients'][2]
+    assert 'id' in errors['ingredients'][3]
+    assert list(errors['tags']) == ['2']
+    assert not Recipe.objects.all().exists()
+
+
 @pytest.mark.django_db(transaction=True)
 def test_create_recipe_unavailable_to_guest(guest_client, valid_recipe_data):
     response = guest_client.post(
@@ -370,3 +625,228 @@ def test_delete_recipe_allowed_only_to_author(authorized_client_1,
     assert response.status_code != 404
     assert response.status_code == 204
     assert Recipe.objects.all().count() == len(test_recipes) - 1
+
+
+def create_recipes(author, tags, ingredients, count):
+    Recipe.objects.bulk_create(
+        Recipe(
+            author=author,
+            image='',
+            name=f'Рецепт {i}',
+            text=f'Описание рецепта {i}',
+            cooking_time=i + 1
+        ) for i in range(count)
+    )
+    recipes = Recipe.objects.all()
+    Recipe.tags.through.objects.bulk_create(
+        Recipe.tags.through(recipe=recipe, tag=tag)
+        for recipe in recipes for tag in tags
+    )
+    RecipeIngredients.objects.bulk_create(
+        RecipeIngredients(recipe=recipe, ingredient=ingredient, amount=1)
+        for recipe in recipes for ingredient in ingredients
+    )
+
+
+# count, recipes, authors, tags, recipe ingredients; catalog version
+# (part of recipes cache keys) is loaded beforehand
+RECIPES_LIST_QUERIES = 5
+# count, recipes with viewer flags
+CACHED_RECIPES_LIST_QUERIES = 2
+
+
+@pytest.mark.parametrize('limit', [6, 100])
+def test_recipes_list_query_count(guest_client,
+                                  authorized_client_1,
+                                  test_user_1,
+                                  test_user_2,
+                                  test_tags,
+                                  test_ingredients,
+                                  django_assert_num_queries,
+                                  limit):
+    create_recipes(test_user_2, test_tags, test_ingredients, 100)
+    catalog_bundle.get_snapshot()
+    endpoint = RECIPES_ENDPOINT + f'?limit={limit}'
+
+    with django_assert_num_queries(RECIPES_LIST_QUERIES):
+        response = guest_client.get(endpoint)
+    assert response.status_code == 200
+    assert len(response.json()['results']) == limit
+
+    test_user_1.subscribed_to.add(test_user_2)
+    # recipes are taken from cache, one more query to authenticate token
+    with django_assert_num_queries(CACHED_RECIPES_LIST_QUERIES + 1):
+        response = authorized_client_1.get(endpoint)
+    assert response.status_code == 200
+
+    results = response.json()['results']
+    assert len(results) == limit
+    assert all(recipe['author']['is_subscribed'] for recipe in results)
+    assert all(
+        len(recipe['ingredients']) == len(test_ingredients)
+        for recipe in results
+    )
+    assert all(len(recipe['tags']) == len(test_tags) for recipe in results)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_cached_recipes_follow_changes(authorized_client_1,
+                                       guest_client,
+                                       test_user_1,
+                                       test_recipes,
+                                       valid_recipe_data):
+    recipe = test_recipes.get(author=test_user_1)
+    endpoint = RECIPES_ENDPOINT + f'{recipe.pk}/'
+    assert guest_client.get(endpoint).json()['is_favorited'] is False
+
+    # viewer flags are not shared through cache
+    Favorite.objects.create(user=test_user_1, recipe=recipe)
+    assert authorized_client_1.get(endpoint).json()['is_favorited'] is True
+    assert guest_client.get(endpoint).json()['is_favorited'] is False
+
+    authorized_client_1.patch(
+        endpoint, {**valid_recipe_data, 'name': 'Новое название'},
+        format='json'
+    )
+    assert guest_client.get(endpoint).json()['name'] == 'Новое название'
+
+    test_user_1.first_name = 'Новое имя'
+    test_user_1.save()
+    data = guest_client.get(endpoint).json()
+    assert data['author']['first_name'] == 'Новое имя'
+
+    ingredient = recipe.ingredients.first()
+    ingredient.name = 'Новый ингредиент'
+    ingredient.save()
+    data = guest_client.get(RECIPES_ENDPOINT).json()['results']
+    assert 'Новый ингредиент' in [
+        item['name'] for item in data[1]['ingredients']
+    ]
+    assert data[1]['id'] == recipe.pk
+
+
+# token, ingredients and tags validation, BEGIN, recipe insert, author
+# recipes counter, ingredients and tags inserts, tags, ingredients and
+# author subscription for response
+CREATE_RECIPE_QUERIES = 11
+# recipe (user is taken from token cache), ingredients and tags
+# validation, BEGIN, recipe update, saved ingredients, ingredients update,
+# shopping carts, saved tags, tags delete, tags, ingredients and author
+# subscription for response
+UPDATE_RECIPE_QUERIES = 13
+
+
+@pytest.mark.django_db(transaction=True)
+def test_create_and_update_recipe_query_count(authorized_client_1,
+                                              valid_recipe_data,
+                                              django_user_model,
+                                              django_assert_num_queries):
+    with django_assert_num_queries(CREATE_RECIPE_QUERIES):
+        response = authorized_client_1.post(
+            RECIPES_ENDPOINT, valid_recipe_data, format='json'
+        )
+    assert response.status_code == 201
+    assert django_user_model.objects.get(
+        pk=response.json()['author']['id']
+    ).recipes_count == 1
+
+    recipe = Recipe.objects.get(pk=response.json()['id'])
+    saved_entries = {
+        entry.ingredient_id: entry.pk
+        for entry in recipe.recipe_ingredients.all()
+    }
+    valid_recipe_data['ingredients'][0]['amount'] = 99
+    valid_recipe_data['tags'] = valid_recipe_data['tags'][:1]
+    with django_assert_num_queries(UPDATE_RECIPE_QUERIES):
+        response = authorized_client_1.patch(
+            RECIPES_ENDPOINT + f'{recipe.pk}/', valid_recipe_data,
+            format='json'
+        )
+    assert response.status_code == 200
+
+    data = response.json()
+    assert [tag['id'] for tag in data['tags']] == valid_recipe_data['tags']
+    assert {
+        (ingredient['id'], ingredient['amount'])
+        for ingredient in data['ingredients']
+    } == {
+        (ingredient['id'], ingredient['amount'])
+        for ingredient in valid_recipe_data['ingredients']
+    }
+    # unchanged rows are updated in place
+    assert {
+        entry.ingredient_id: entry.pk
+        for entry in recipe.recipe_ingredients.all()
+    } == saved_entries
+
+
+@pytest.mark.django_db(transaction=True)
+def test_update_recipe_replaces_ingredients(authorized_client_1,
+                                            test_ingredients,
+                                            valid_recipe_data):
+    response = authorized_client_1.post(
+        RECIPES_ENDPOINT, valid_recipe_data, format='json'
+    )
+    recipe = Recipe.objects.get(pk=response.json()['id'])
+
+    valid_recipe_data['ingredients'] = [
+        {'id': test_ingredients[1].pk, 'amount': 5},
+        {'id': test_ingredients[2].pk, 'amount': 7}
+    ]
+    response = authorized_client_1.patch(
+        RECIPES_ENDPOINT + f'{recipe.pk}/', valid_recipe_data, format='json'
+    )
+    assert response.status_code == 200
+    assert set(
+        recipe.recipe_ingredients.values_list('ingredient', 'amount')
+    ) == {(test_ingredients[1].pk, 5), (test_ingredients[2].pk, 7)}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_create_recipe_is_atomic(authorized_client_1,
+                                 valid_recipe_data,
+                                 monkeypatch):
+    def broken_set_tags(*args, **kwargs):
+        raise RuntimeError
+
+    monkeypatch.setattr(RecipeWriteSerializer, 'set_tags', broken_set_tags)
+    with pytest.raises(RuntimeError):
+        authorized_client_1.post(
+            RECIPES_ENDPOINT, valid_recipe_data, format='json'
+        )
+    assert not Recipe.objects.exists()
+    assert not RecipeIngredients.objects.exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_update_recipe_keeps_counters(authorized_client_1,
+                                      test_user_1,
+                                      test_user_2,
+                                      test_recipes,
+                                      valid_recipe_data,
+                                      monkeypatch):
+    recipe = test_recipes.get(author=test_user_1)
+    update = RecipeWriteSerializer.update
+
+    def update_after_favorite(self, instance, validated_data):
+        # recipe is favorited, after it was loaded by the view
+        Favorite.add(test_user_2, instance)
+        return update(self, instance, validated_data)
+
+    monkeypatch.setattr(
+        RecipeWriteSerializer, 'update', update_after_favorite
+    )
+    response = authorized_client_1.patch(
+        RECIPES_ENDPOINT + f'{recipe.pk}/', valid_recipe_data, format='json'
+    )
+    assert response.status_code == 200
+    recipe = Recipe.objects.get(pk=recipe.pk)
+    assert recipe.favorites_count == 1
+
+    # outdated instance (e.g. in admin) doesn't roll counters back
+    ShoppingList.add(test_user_2, recipe)
+    recipe.name = 'Новое название'
+    recipe.save()
+    recipe = Recipe.objects.get(pk=recipe.pk)
+    assert recipe.name == 'Новое название'
+    assert (recipe.favorites_count, recipe.shopping_carts_count) == (1, 1)
@@ -1,8 +1,24 @@
+import csv
+import importlib
+import json
+import time
+
 import pytest
 
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+
+from recipes.models import Ingredient, ShoppingCartIngredient
+from api import services
+from api.exceptions import ServiceUnavailable
+from api.services import RenderPool, ShoppingListGenerator
+
 
 SHOPPING_LIST_ENDPOINT = '/api/recipes/download_shopping_cart/'
 MODIFY_SHOPPING_LIST_ENDPOINT = '/api/recipes/{id}/shopping_cart/'
+SHOPPING_CART_SUMMARY_ENDPOINT = '/api/recipes/shopping_cart_summary/'
 SHOPPING_LIST_REICPE_FIELDS = {
     'id',
     'name',
@@ -106,3 +122,381 @@ def test_can_not_del_unexisting_recipe_from_shopping_list(authorized_client_1,
 
     new_shopping_list_count = test_user_1.shoppinglist_recipes.all().count()
     assert new_shopping_list_count == shopping_list_count
+
+
+@pytest.mark.django_db(transaction=True)
+def test_shopping_list_ingredients_aggregation(shopping_list_recipes,
+                                               test_user_1,
+                                               django_assert_num_queries):
+    salt_kg = Ingredient.objects.create(name='Salt', measurement_unit='kg')
+    shopping_list_recipes[0].ingredients.add(
+        salt_kg, through_defaults={'amount': 7}
+    )
+    ShoppingCartIngredient.objects.rebuild([test_user_1.pk])
+    generator = ShoppingListGenerator(test_user_1)
+    with django_assert_num_queries(1):
+        ingredients = list(generator.get_ingredients())
+
+    amounts = {
+        (entry['name'], entry['measurement_unit']): entry['amount']
+        for entry in ingredients
+    }
+    assert len(ingredients) == 4
+    assert amounts == {
+        ('Milk', 'l'): 5,
+        ('Salt', 'g'): 5,
+        ('Salt', 'kg'): 7,
+        ('Sugar', 'kg'): 5
+    }
+
+
+@pytest.mark.django_db(transaction=True)
+def test_shopping_list_etag(authorized_client_1, shopping_list_recipes):
+    response = authorized_client_1.get(SHOPPING_LIST_ENDPOINT)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    response = authorized_client_1.get(
+        SHOPPING_LIST_ENDPOINT, HTTP_IF_NONE_MATCH=etag
+    )
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+
+
+@pytest.mark.django_db(transaction=True)
+def test_shopping_list_cache_invalidation(authorized_client_1,
+                                          shopping_list_recipes):
+    recipe = shopping_list_recipes[0]
+    endpoint = MODIFY_SHOPPING_LIST_ENDPOINT.format(id=recipe.id)
+    etags = set()
+
+    response = authorized_client_1.get(SHOPPING_LIST_ENDPOINT)
+    etags.add(response.headers['ETag'])
+    first_pdf = response.content
+
+    response = authorized_client_1.delete(endpoint)
+    assert response.status_code == 204
+    response = authorized_client_1.get(
+        SHOPPING_LIST_ENDPOINT, HTTP_IF_NONE_MATCH=response.get('ETag', '')
+    )
+    assert response.status_code == 200
+    assert response.headers['ETag'] not in etags
+    assert response.content != first_pdf
+    etags.add(response.headers['ETag'])
+
+    response = authorized_client_1.post(endpoint)
+    assert response.status_code == 201
+    response = authorized_client_1.get(SHOPPING_LIST_ENDPOINT)
+    assert response.status_code == 200
+    assert response.headers['ETag'] not in etags
+
+    # failed modifications do not change cart version
+    etag = response.headers['ETag']
+    response = authorized_client_1.post(endpoint)
+    assert response.status_code == 400
+    response = authorized_client_1.get(
+        SHOPPING_LIST_ENDPOINT, HTTP_IF_NONE_MATCH=etag
+    )
+    assert response.status_code == 304
+
+
+@pytest.mark.django_db(transaction=True)
+def test_shopping_list_invalidated_on_recipe_update(authorized_client_1,
+                                                    test_user_1,
+                                                    valid_recipe_data):
+    response = authorized_client_1.post(
+        '/api/recipes/', valid_recipe_data, format='json'
+    )
+    recipe_id = response.json()['id']
+    authorized_client_1.post(
+        MODIFY_SHOPPING_LIST_ENDPOINT.format(id=recipe_id)
+    )
+    etag = authorized_client_1.get(SHOPPING_LIST_ENDPOINT).headers['ETag']
+
+    valid_recipe_data['ingredients'][0]['amount'] += 1
+    response = authorized_client_1.patch(
+        f'/api/recipes/{recipe_id}/', valid_recipe_data, format='json'
+    )
+    assert response.status_code == 200
+    response = authorized_client_1.get(
+        SHOPPING_LIST_ENDPOINT, HTTP_IF_NONE_MATCH=etag
+    )
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    response = authorized_client_1.delete(f'/api/recipes/{recipe_id}/')
+    assert response.status_code == 204
+    response = authorized_client_1.get(
+        SHOPPING_LIST_ENDPOINT, HTTP_IF_NONE_MATCH=etag
+    )
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db(transaction=True)
+def test_shopping_list_render_failed(authorized_client_1,
+                                     shopping_list_recipes,
+                                     monkeypatch):
+    monkeypatch.setattr(
+        ShoppingListGenerator, 'render_pdf', lambda self, ingredients: None
+    )
+    response = authorized_client_1.get(SHOPPING_LIST_ENDPOINT)
+    assert response.status_code == 500
+    assert 'ETag' not in response
+    assert 'detail' in response.json()
+
+    monkeypatch.undo()
+    response = authorized_client_1.get(SHOPPING_LIST_ENDPOINT)
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/pdf'
+
+
+@pytest.mark.django_db(transaction=True)
+def test_shopping_list_render_pool_saturated(authorized_client_1,
+                                             shopping_list_recipes,
+                                             monkeypatch):
+    pool = RenderPool(workers=1, queue_size=0, timeout=5)
+    monkeypatch.setattr(services, 'get_render_pool', lambda: pool)
+    pool._slots.acquire()
+    response = authorized_client_1.get(SHOPPING_LIST_ENDPOINT)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+
+    pool._slots.release()
+    response = authorized_client_1.get(SHOPPING_LIST_ENDPOINT)
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/pdf'
+
+
+def test_render_pool_timeout():
+    pool = RenderPool(workers=1, queue_size=0, timeout=0.1)
+    with pytest.raises(ServiceUnavailable):
+        pool.run(time.sleep, 1)
+    # slot is released, when timed out job finishes
+    with pytest.raises(ServiceUnavailable):
+        pool.run(time.sleep, 0)
+    time.sleep(1.5)
+    assert pool.run(abs, -1) == 1
+
+
+def test_render_pool_shares_timed_out_job():
+    pool = RenderPool(workers=1, queue_size=0, timeout=0.3)
+    results = []
+    with pytest.raises(ServiceUnavailable):
+        pool.run(time.sleep, 0.5, key='job', on_result=results.append)
+    # running job with the same key is awaited, instead of taking a new slot
+    assert pool.run(time.sleep, 0.5, key='job') is None
+    time.sleep(0.1)
+    assert results == [None]
+    assert pool.run(abs, -1, key='job') == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_shopping_list_cached_after_render_timeout(authorized_client_1,
+                                                   shopping_list_recipes,
+                                                   test_user_1,
+                                                   monkeypatch):
+    pool = RenderPool(workers=1, queue_size=0, timeout=0.001)
+    monkeypatch.setattr(services, 'get_render_pool', lambda: pool)
+    response = authorized_client_1.get(SHOPPING_LIST_ENDPOINT)
+    assert response.status_code == 503
+
+    # timed out render is finished and cached, so retry is not rendered again
+    cache_key = ShoppingListGenerator(test_user_1).get_cache_key()
+    deadline = time.monotonic() + 60
+    while cache.get(cache_key) is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+    pool.timeout = 0
+    response = authorized_client_1.get(SHOPPING_LIST_ENDPOINT)
+    assert response.status_code == 200
+    assert response.content.startswith(b'%PDF')
+
+
+@pytest.mark.django_db(transaction=True)
+def test_get_shopping_list_reportlab_renderer(authorized_client_1,
+                                              shopping_list_recipes,
+                                              settings):
+    settings.SHOPPING_LIST_PDF_RENDERER = 'reportlab'
+    response = authorized_client_1.get(SHOPPING_LIST_ENDPOINT)
+
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/pdf'
+    assert response.content.startswith(b'%PDF')
+    assert 'reportlab' in response.headers['ETag']
+
+
+@pytest.mark.django_db(transaction=True)
+def test_get_shopping_list_in_other_formats(authorized_client_1,
+                                            shopping_list_recipes):
+    expected = {('Milk', 'l', 5), ('Salt', 'g', 5), ('Sugar', 'kg', 5)}
+
+    response = authorized_client_1.get(SHOPPING_LIST_ENDPOINT + '?format=json')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/json'
+    data = json.loads(b''.join(response.streaming_content))
+    assert {
+        (entry['name'], entry['measurement_unit'], entry['amount'])
+        for entry in data
+    } == expected
+
+    response = authorized_client_1.get(
+        SHOPPING_LIST_ENDPOINT, HTTP_ACCEPT='text/csv'
+    )
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/csv')
+    content = b''.join(response.streaming_content).decode()
+    rows = list(csv.reader(content.splitlines()))
+    assert rows[0] == ['name', 'measurement_unit', 'amount']
+    assert {(name, unit, int(amount)) for name, unit, amount in rows[1:]} == (
+        expected
+    )
+
+    response = authorized_client_1.get(SHOPPING_LIST_ENDPOINT + '?format=txt')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/plain')
+    content = b''.join(response.streaming_content).decode()
+    assert 'Salt (g) — 5' in content
+
+    response = authorized_client_1.get(SHOPPING_LIST_ENDPOINT + '?format=xml')
+    assert response.status_code == 404
+    assert response.headers['Content-Type'] == 'application/json'
+    assert 'detail' in response.json()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_shopping_list_formats_errors_rendered_as_json(guest_client):
+    response = guest_client.get(SHOPPING_LIST_ENDPOINT + '?format=csv')
+    assert response.status_code == 401
+    assert response.headers['Content-Type'] == 'application/json'
+    assert 'detail' in response.json()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_shopping_cart_summary(authorized_client_1, test_recipes,
+                               test_user_1, valid_recipe_data):
+    def get_summary():
+        response = authorized_client_1.get(SHOPPING_CART_SUMMARY_ENDPOINT)
+        assert response.status_code == 200
+        return {
+            entry['name']: entry['amount'] for entry in response.json()
+        }
+
+    assert get_summary() == {}
+    for recipe in test_recipes:
+        authorized_client_1.post(
+            MODIFY_SHOPPING_LIST_ENDPOINT.format(id=recipe.id)
+        )
+    assert get_summary() == {'Milk': 5, 'Salt': 5, 'Sugar': 5}
+
+    authorized_client_1.delete(
+        MODIFY_SHOPPING_LIST_ENDPOINT.format(id=test_recipes[0].id)
+    )
+    assert get_summary() == {'Milk': 3, 'Salt': 3, 'Sugar': 3}
+
+    # recipe ingredients change is applied to shopping carts
+    response = authorized_client_1.post(
+        '/api/recipes/', valid_recipe_data, format='json'
+    )
+    recipe_id = response.json()['id']
+    authorized_client_1.post(
+        MODIFY_SHOPPING_LIST_ENDPOINT.format(id=recipe_id)
+    )
+    assert get_summary() == {'Milk': 3, 'Salt': 13, 'Sugar': 8}
+
+    valid_recipe_data['ingredients'] = [
+        {'id': valid_recipe_data['ingredients'][1]['id'], 'amount': 1}
+    ]
+    authorized_client_1.patch(
+        f'/api/recipes/{recipe_id}/', valid_recipe_data, format='json'
+    )
+    assert get_summary() == {'Milk': 3, 'Salt': 3, 'Sugar': 4}
+
+    authorized_client_1.delete(f'/api/recipes/{recipe_id}/')
+    assert get_summary() == {'Milk': 3, 'Salt': 3, 'Sugar': 3}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_admin_recipe_delete_updates_shopping_carts(client,
+                                                    django_user_model,
+                                                    shopping_list_recipes,
+                                                    test_user_1):
+    client.force_login(
+        django_user_model.objects.create_superuser(
+            email='admin@example.com', username='admin', password='admin'
+        )
+    )
+
+    def get_totals():
+        return dict(
+            test_user_1.shopping_cart_ingredients.filter(
+                amount__gt=0
+            ).values_list('ingredient__name', 'amount')
+        )
+
+    assert get_totals() == {'Milk': 5, 'Salt': 5, 'Sugar': 5}
+    first = shopping_list_recipes.get(name='Тестовый рецепт 1')
+    second = shopping_list_recipes.get(name='Тестовый рецепт 2')
+    response = client.post(
+        f'/admin/recipes/recipe/{first.pk}/delete/', {'post': 'yes'}
+    )
+    assert response.status_code == 302
+    assert get_totals() == {'Milk': 2, 'Salt': 2, 'Sugar': 2}
+    version = type(test_user_1).objects.get(
+        pk=test_user_1.pk
+    ).shopping_cart_version
+    assert version > test_user_1.shopping_cart_version
+
+    response = client.post(
+        '/admin/recipes/recipe/',
+        {'action': 'delete_selected', '_selected_action': [second.pk],
+         'post': 'yes'}
+    )
+    assert response.status_code == 302
+    assert get_totals() == {}
+    assert type(test_user_1).objects.get(
+        pk=test_user_1.pk
+    ).shopping_cart_version > version
+
+
+@pytest.mark.django_db(transaction=True)
+def test_rebuild_shopping_carts_command(shopping_list_recipes, test_user_1):
+    totals = set(
+        ShoppingCartIngredient.objects.values_list(
+            'user', 'ingredient', 'amount'
+        )
+    )
+    ShoppingCartIngredient.objects.filter(ingredient__name='Salt').delete()
+    ShoppingCartIngredient.objects.filter(ingredient__name='Milk').update(
+        amount=100
+    )
+
+    call_command('rebuild_shopping_carts', '--check')
+    assert ShoppingCartIngredient.objects.count() == 2
+
+    call_command('rebuild_shopping_carts')
+    assert set(
+        ShoppingCartIngredient.objects.values_list(
+            'user', 'ingredient', 'amount'
+        )
+    ) == totals
+
+
+@pytest.mark.django_db(transaction=True)
+def test_shopping_carts_filled_by_migration(shopping_list_recipes):
+    totals = set(
+        ShoppingCartIngredient.objects.values_list(
+            'user', 'ingredient', 'amount'
+        )
+    )
+    ShoppingCartIngredient.objects.all().delete()
+    migration = importlib.import_module(
+        'recipes.migrations.0003_shopping_cart_ingredient'
+    )
+    state = MigrationLoader(connection).project_state(
+        ('recipes', '0003_shopping_cart_ingredient')
+    )
+    migration.fill_shopping_carts(state.apps, None)
+    assert set(
+        ShoppingCartIngredient.objects.values_list(
+            'user', 'ingredient', 'amount'
+        )
+    ) == totals
@@ -1,4 +1,13 @@
+import threading
+
 import pytest
+from django.db import connection
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes import models
+from recipes.models import (Favorite, Recipe, ShoppingCartIngredient,
+                            ShoppingList, recount_counters)
 
 
 MODIFY_FAVORITES_ENDPOINT = '/api/recipes/{id}/favorite/'
@@ -91,3 +100,258 @@ def test_can_not_del_unexisting_recipe_from_favorites(authorized_client_1,
 
     new_favorites_count = test_user_1.favorite_recipes.all().count()
     assert new_favorites_count == favorites_count
+
+
+@pytest.mark.django_db(transaction=True)
+def test_recipe_counters(authorized_client_1,
+                         authorized_client_2,
+                         test_recipes):
+    recipe = test_recipes[0]
+    endpoints = {
+        'favorites_count': MODIFY_FAVORITES_ENDPOINT.format(id=recipe.id),
+        'shopping_carts_count': (
+            f'/api/recipes/{recipe.id}/shopping_cart/'
+        )
+    }
+    for counter, endpoint in endpoints.items():
+        authorized_client_1.post(endpoint)
+        authorized_client_2.post(endpoint)
+        # repeated request must not change the counter
+        authorized_client_2.post(endpoint)
+        recipe.refresh_from_db()
+        assert getattr(recipe, counter) == 2
+
+        authorized_client_1.delete(endpoint)
+        authorized_client_1.delete(endpoint)
+        recipe.refresh_from_db()
+        assert getattr(recipe, counter) == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_user_delete_updates_counters(test_user_1,
+                                      test_user_2,
+                                      test_recipes,
+                                      django_user_model):
+    recipe = test_recipes.get(author=test_user_2)
+    Favorite.add(test_user_1, recipe)
+    ShoppingList.add(test_user_1, recipe)
+    test_user_1.subscribe(test_user_2)
+    test_user_2.subscribe(test_user_1)
+
+    test_user_1.delete()
+
+    def get_counters():
+        return (
+            list(Recipe.objects.values_list(
+                'pk', 'favorites_count', 'shopping_carts_count'
+            )),
+            list(django_user_model.objects.values_list(
+                'username', 'recipes_count', 'followers_count',
+                'following_count'
+            ))
+        )
+
+    counters = get_counters()
+    recount_counters()
+    assert counters == get_counters()
+    assert django_user_model.objects.get(username='deleted').recipes_count == 1
+
+
+def begin_immediate(execute, sql, params, many, context):
+    """Starts SQLite transactions with write lock, so concurrent writers
+    wait for each other instead of failing with `locked` error."""
+    if sql == 'BEGIN':
+        sql = 'BEGIN IMMEDIATE'
+    return execute(sql, params, many, context)
+
+
+def send_concurrently(token, method, endpoint, data=None, count=8):
+    """
+    Sends `count` requests at once, returns responses. SQLite transactions
+    of requests are executed one at a time, so outcomes and counters of
+    concurrent requests are checked, but not a race between them.
+    """
+    barrier = threading.Barrier(count)
+    results = []
+
+    def send():
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+        barrier.wait()
+        try:
+            with connection.execute_wrapper(begin_immediate):
+                response = getattr(client, method)(
+                    endpoint, data, format='json'
+                )
+            results.append(response)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=send) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == count
+    return results
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('model', [Favorite, ShoppingList])
+def test_add_ignores_concurrent_insert(test_user_1, test_recipes, model,
+                                       monkeypatch):
+    insert = models.insert_ignoring_conflicts
+
+    def insert_after_concurrent_request(*args, **kwargs):
+        # the same rows are inserted by concurrent request, after they were
+        # found missing and before this request inserts them
+        insert(*args)
+        return insert(*args, **kwargs)
+
+    monkeypatch.setattr(
+        models, 'insert_ignoring_conflicts', insert_after_concurrent_request
+    )
+    assert model.add(test_user_1, test_recipes[0]) == 0
+    assert model.add_many(
+        test_user_1, [recipe.pk for recipe in test_recipes]
+    ) == set()
+    assert model.objects.filter(user=test_user_1).count() == 2
+    # entries inserted by concurrent request are not counted by this one
+    assert not Recipe.objects.filter(**{f'{model.counter_field}__gt': 0})
+    if model is ShoppingList:
+        assert not ShoppingCartIngredient.objects.filter(amount__gt=0)
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('path', ['favorite', 'shopping_cart'])
+def test_concurrent_toggles(test_user_1, test_recipes, path):
+    token = Token.objects.create(user=test_user_1).key
+    recipe = test_recipes[0]
+    endpoint = f'/api/recipes/{recipe.id}/{path}/'
+    model_class = {'favorite': Favorite, 'shopping_cart': ShoppingList}[path]
+    counter = model_class.counter_field
+
+    results = send_concurrently(token, 'post', endpoint)
+    assert sorted(
+        response.status_code for response in results
+    ) == [201] + [400] * 7
+    entries = model_class.objects.filter(user=test_user_1, recipe=recipe)
+    assert entries.count() == 1
+    recipe.refresh_from_db()
+    assert getattr(recipe, counter) == entries.count()
+
+    results = send_concurrently(token, 'delete', endpoint)
+    assert sorted(
+        response.status_code for response in results
+    ) == [204] + [400] * 7
+    assert not entries.exists()
+    recipe.refresh_from_db()
+    assert getattr(recipe, counter) == entries.count()
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('path', ['favorite', 'shopping_cart'])
+@pytest.mark.parametrize('returning', [True, False])
+def test_bulk_toggles(authorized_client_1, test_user_1, test_recipes,
+                      monkeypatch, path, returning):
+    # databases without INSERT ... RETURNING insert entries one by one
+    monkeypatch.setattr(
+        'recipes.db.can_return_from_insert', lambda connection: returning
+    )
+    endpoint = f'/api/recipes/{path}/'
+    model_class = {'favorite': Favorite, 'shopping_cart': ShoppingList}[path]
+    first, second = (recipe.id for recipe in test_recipes)
+    model_class.add(test_user_1, test_recipes.get(pk=first))
+
+    response = authorized_client_1.post(
+        endpoint, {'ids': [first, second, second, 0]}, format='json'
+    )
+    assert response.status_code == 400
+    response = authorized_client_1.post(
+        endpoint, {'ids': [first, second, second, 10 ** 6]}, format='json'
+    )
+    assert response.status_code == 200
+    assert response.json()['results'] == [
+        {'id': first, 'status': 'exists'},
+        {'id': second, 'status': 'added'},
+        {'id': 10 ** 6, 'status': 'not_found'}
+    ]
+    entries = model_class.objects.filter(user=test_user_1)
+    assert set(entries.values_list('recipe', flat=True)) == {first, second}
+    assert set(
+        test_recipes.values_list(model_class.counter_field, flat=True)
+    ) == {1}
+    if model_class is ShoppingList:
+        # totals match cart built from scratch
+        totals = set(
+            test_user_1.shopping_cart_ingredients.values_list(
+                'ingredient', 'amount'
+            )
+        )
+        ShoppingCartIngredient.objects.rebuild([test_user_1.pk])
+        assert totals == set(
+            test_user_1.shopping_cart_ingredients.values_list(
+                'ingredient', 'amount'
+            )
+        )
+
+    response = authorized_client_1.delete(
+        endpoint, {'ids': [second]}, format='json'
+    )
+    assert response.json()['results'] == [{'id': second, 'status': 'removed'}]
+    response = authorized_client_1.delete(
+        endpoint, {'ids': [first, second]}, format='json'
+    )
+    assert response.json()['results'] == [
+        {'id': first, 'status': 'removed'},
+        {'id': second, 'status': 'missing'}
+    ]
+    assert not entries.exists()
+    assert set(
+        test_recipes.values_list(model_class.counter_field, flat=True)
+    ) == {0}
+    if model_class is ShoppingList:
+        assert not test_user_1.shopping_cart_ingredients.filter(
+            amount__gt=0
+        ).exists()
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('path', ['favorite', 'shopping_cart'])
+def test_concurrent_bulk_adds(test_user_1, test_recipes, path):
+    token = Token.objects.create(user=test_user_1).key
+    model_class = {'favorite': Favorite, 'shopping_cart': ShoppingList}[path]
+    ids = [recipe.id for recipe in test_recipes]
+
+    results = send_concurrently(
+        token, 'post', f'/api/recipes/{path}/', {'ids': ids}
+    )
+    outcomes = [
+        (result['id'], result['status'])
+        for response in results for result in response.json()['results']
+    ]
+    # every recipe is reported as added by a single request
+    assert sorted(outcomes) == sorted(
+        [(pk, 'added') for pk in ids] + [(pk, 'exists') for pk in ids] * 7
+    )
+
+    assert set(
+        model_class.objects.filter(user=test_user_1).values_list(
+            'recipe', flat=True
+        )
+    ) == set(ids)
+    assert set(
+        test_recipes.values_list(model_class.counter_field, flat=True)
+    ) == {1}
+    if model_class is ShoppingList:
+        totals = set(
+            test_user_1.shopping_cart_ingredients.values_list(
+                'ingredient', 'amount'
+            )
+        )
+        ShoppingCartIngredient.objects.rebuild([test_user_1.pk])
+        assert totals == set(
+            test_user_1.shopping_cart_ingredients.values_list(
+                'ingredient', 'amount'
+            )
+        )
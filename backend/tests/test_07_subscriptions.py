@@ -1,5 +1,10 @@
 import pytest
 
+from django.core.management import call_command
+
+from recipes.models import Recipe, recount_counters
+from users import models
+
 
 SUBSCRIPTIONS_ENDPOINT = '/api/users/subscriptions/'
 SUBSCRIPTION_MODIFY_ENDPOINT = '/api/users/{id}/subscribe/'
@@ -69,6 +74,82 @@ def test_get_subscriptions_with_query_params(authorized_client_1,
     assert len(data['results'][0]['recipes']) == 1
 
 
+@pytest.mark.django_db(transaction=True)
+def test_get_subscriptions_with_cursor(authorized_client_1,
+                                       test_user_1,
+                                       django_user_model):
+    authors = [
+        django_user_model.objects.create(
+            email=f'author{i}@example.com',
+            username=f'author{i}',
+            first_name='Автор',
+            last_name=f'{i}'
+        )
+        for i in range(5)
+    ]
+    test_user_1.subscribed_to.add(*authors)
+    endpoint = SUBSCRIPTIONS_ENDPOINT + '?limit=2&cursor='
+    usernames = []
+    while endpoint:
+        response = authorized_client_1.get(endpoint)
+        assert response.status_code == 200
+        data = response.json()
+        assert 'count' not in data
+        usernames += [user['username'] for user in data['results']]
+        endpoint = data['next']
+    assert usernames == [author.username for author in authors]
+
+
+# token, count, subscriptions, recipes
+SUBSCRIPTIONS_QUERIES = 4
+
+
+@pytest.mark.parametrize('recipes_limit', ['', '&recipes_limit=2'])
+@pytest.mark.django_db(transaction=True)
+def test_subscriptions_query_count(authorized_client_1,
+                                   test_user_1,
+                                   django_user_model,
+                                   django_assert_num_queries,
+                                   recipes_limit):
+    authors = [
+        django_user_model.objects.create(
+            email=f'author{i}@example.com',
+            username=f'author{i}',
+            first_name='Автор',
+            last_name=f'{i}'
+        )
+        for i in range(10)
+    ]
+    Recipe.objects.bulk_create(
+        Recipe(
+            author=author,
+            image='',
+            name=f'Рецепт {i}',
+            text='Описание',
+            cooking_time=1
+        )
+        for author in authors for i in range(3)
+    )
+    test_user_1.subscribed_to.add(*authors)
+    recount_counters()
+
+    with django_assert_num_queries(SUBSCRIPTIONS_QUERIES):
+        response = authorized_client_1.get(
+            SUBSCRIPTIONS_ENDPOINT + '?limit=10' + recipes_limit
+        )
+    assert response.status_code == 200
+
+    results = response.json()['results']
+    assert len(results) == 10
+    for author in results:
+        assert author['recipes_count'] == 3
+        assert len(author['recipes']) == (2 if recipes_limit else 3)
+        recipes = Recipe.objects.filter(author=author['id'])
+        assert [recipe['id'] for recipe in author['recipes']] == list(
+            recipes.values_list('id', flat=True)
+        )[:len(author['recipes'])]
+
+
 @pytest.mark.django_db(transaction=True)
 def test_subscribe_to_user(authorized_client_1,
                            test_user_1,
@@ -113,6 +194,40 @@ def test_unsubscribe_user(authorized_client_1,
     assert test_user_1.subscribed_to.all().count() == subscriptions_count - 1
 
 
+@pytest.mark.django_db(transaction=True)
+def test_subscription_counters(authorized_client_1,
+                               test_user_1,
+                               test_user_2):
+    endpoint = SUBSCRIPTION_MODIFY_ENDPOINT.format(id=test_user_2.id)
+
+    authorized_client_1.post(endpoint)
+    test_user_1.refresh_from_db()
+    test_user_2.refresh_from_db()
+    assert test_user_1.following_count == 1
+    assert test_user_2.followers_count == 1
+    assert test_user_2.following_count == 0
+
+    authorized_client_1.delete(endpoint)
+    test_user_1.refresh_from_db()
+    test_user_2.refresh_from_db()
+    assert test_user_1.following_count == 0
+    assert test_user_2.followers_count == 0
+
+
+@pytest.mark.django_db(transaction=True)
+def test_recount_counters_command(test_user_1, test_user_2, test_recipes):
+    test_user_1.subscribed_to.add(test_user_2)
+    test_recipes.update(favorites_count=10)
+
+    call_command('recount_counters')
+    test_user_1.refresh_from_db()
+    test_user_2.refresh_from_db()
+    assert test_user_1.following_count == 1
+    assert test_user_2.followers_count == 1
+    assert test_user_2.recipes_count == 1
+    assert set(test_recipes.values_list('favorites_count', flat=True)) == {0}
+
+
 @pytest.mark.django_db(transaction=True)
 def test_sub_endpoints_can_not_be_accessed_by_guest(guest_client,
                                                     test_user_2):
@@ -131,3 +246,53 @@ def test_sub_endpoints_can_not_be_accessed_by_guest(guest_client,
     )
     assert response.status_code != 404
     assert response.status_code == 401
+
+
+@pytest.mark.django_db(transaction=True)
+def test_bulk_subscribe(authorized_client_1, test_user_1, test_user_2):
+    endpoint = '/api/users/subscribe/'
+    ids = [test_user_1.id, test_user_2.id, 10 ** 6]
+
+    response = authorized_client_1.post(endpoint, {'ids': ids}, format='json')
+    assert response.status_code == 200
+    assert response.json()['results'] == [
+        {'id': test_user_1.id, 'status': 'self'},
+        {'id': test_user_2.id, 'status': 'added'},
+        {'id': 10 ** 6, 'status': 'not_found'}
+    ]
+    response = authorized_client_1.post(endpoint, {'ids': ids}, format='json')
+    assert response.json()['results'][1]['status'] == 'exists'
+    assert list(test_user_1.subscribed_to.all()) == [test_user_2]
+    test_user_1.refresh_from_db()
+    test_user_2.refresh_from_db()
+    assert test_user_1.following_count == 1
+    assert test_user_2.followers_count == 1
+
+    response = authorized_client_1.delete(
+        endpoint, {'ids': ids}, format='json'
+    )
+    assert response.json()['results'][1]['status'] == 'removed'
+    assert not test_user_1.subscribed_to.exists()
+    test_user_1.refresh_from_db()
+    test_user_2.refresh_from_db()
+    assert test_user_1.following_count == 0
+    assert test_user_2.followers_count == 0
+
+
+@pytest.mark.django_db(transaction=True)
+def test_subscribe_many_ignores_concurrent_insert(test_user_1, test_user_2,
+                                                  monkeypatch):
+    insert = models.insert_ignoring_conflicts
+
+    def insert_after_concurrent_request(*args, **kwargs):
+        # the same subscription is inserted by concurrent request
+        insert(*args)
+        return insert(*args, **kwargs)
+
+    monkeypatch.setattr(
+        models, 'insert_ignoring_conflicts', insert_after_concurrent_request
+    )
+    assert test_user_1.subscribe_many([test_user_2.pk]) == set()
+    assert test_user_1.subscribed_to.get() == test_user_2
+    test_user_2.refresh_from_db()
+    assert test_user_2.followers_count == 0
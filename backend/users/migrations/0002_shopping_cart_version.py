@@ -0,0 +1,18 @@
+# Generated by Django 3.2.12 on 2026-10-18 17:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foodgramuser',
+            name='shopping_cart_version',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Версия списка покупок'),
+        ),
+    ]
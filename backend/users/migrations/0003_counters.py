@@ -0,0 +1,28 @@
+# Generated by Django 3.2.12 on 2026-10-18 17:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_shopping_cart_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foodgramuser',
+            name='followers_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Количество подписчиков'),
+        ),
+        migrations.AddField(
+            model_name='foodgramuser',
+            name='following_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Количество подписок'),
+        ),
+        migrations.AddField(
+            model_name='foodgramuser',
+            name='recipes_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Количество рецептов'),
+        ),
+    ]
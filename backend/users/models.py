@@ -1,9 +1,12 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, Value, When
 from django.contrib.auth.models import AbstractUser
 
 
 from django.core.validators import RegexValidator
 
+from recipes.db import CountersMixin, insert_ignoring_conflicts
+
 
 username_validator = RegexValidator(
     '^[\\w.@+-]+$',
@@ -11,7 +14,7 @@ username_validator = RegexValidator(
 )
 
 
-class FoodgramUser(AbstractUser):
+class FoodgramUser(CountersMixin, AbstractUser):
     email = models.EmailField(
         max_length=254,
         unique=True,
@@ -38,6 +41,35 @@ class FoodgramUser(AbstractUser):
         blank=True,
         verbose_name='Подписки пользователя'
     )
+    shopping_cart_version = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Версия списка покупок'
+    )
+    recipes_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество рецептов'
+    )
+    followers_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписчиков'
+    )
+    following_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписок'
+    )
+
+    # fields, which are shown as recipe author
+    PUBLIC_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+    # fields, which are not saved to existing row (see CountersMixin), as
+    # request user is taken from token cache and may be outdated
+    COUNTER_FIELDS = {
+        'shopping_cart_version', 'recipes_count', 'followers_count',
+        'following_count'
+    }
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
@@ -46,3 +78,85 @@ class FoodgramUser(AbstractUser):
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
         ordering = ['username']
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if not adding and (
+            update_fields is None or self.PUBLIC_FIELDS & {*update_fields}
+        ):
+            # cached representations of user's recipes are no longer used
+            self.recipes.update(cache_version=F('cache_version') + 1)
+
+    def subscribe(self, author):
+        """Subscribes user to author and updates their counters."""
+        FoodgramUser.subscribed_to.through.objects.create(
+            from_foodgramuser=self, to_foodgramuser=author
+        )
+        self.update_subscription_counters([author.pk], 1)
+
+    def unsubscribe(self, author) -> int:
+        """
+        Unsubscribes user from author and updates their counters, returns
+        number of deleted subscriptions.
+        """
+        if not FoodgramUser.subscribed_to.through.objects.filter(
+            from_foodgramuser=self, to_foodgramuser=author
+        ).delete()[0]:
+            return 0
+        self.update_subscription_counters([author.pk], -1)
+        return 1
+
+    def subscribe_many(self, authors) -> set:
+        """
+        Subscribes user to given authors (ids), who user is not subscribed
+        to yet, returns ids of new subscriptions. Only subscriptions inserted
+        by this call are counted, concurrently created ones are skipped.
+        """
+        if not authors:
+            return set()
+        with transaction.atomic():
+            added = insert_ignoring_conflicts(
+                FoodgramUser.subscribed_to.through,
+                ('from_foodgramuser', 'to_foodgramuser'),
+                [(self.pk, author) for author in authors],
+                returning='to_foodgramuser'
+            )
+            if added:
+                self.update_subscription_counters(added, 1)
+        return added
+
+    def unsubscribe_many(self, authors) -> set:
+        """
+        Unsubscribes user from given authors (ids), returns ids of removed
+        subscriptions. Subscriptions are locked until removed with a single
+        DELETE, so concurrent removals are not counted twice.
+        """
+        subscriptions = FoodgramUser.subscribed_to.through.objects.filter(
+            from_foodgramuser=self
+        )
+        with transaction.atomic():
+            removed = set(
+                subscriptions.select_for_update().filter(
+                    to_foodgramuser__in=authors
+                ).values_list('to_foodgramuser', flat=True)
+            )
+            if not removed:
+                return removed
+            subscriptions.filter(to_foodgramuser__in=removed).delete()
+            self.update_subscription_counters(removed, -1)
+        return removed
+
+    def update_subscription_counters(self, authors, delta: int) -> None:
+        """Changes following counter of user and followers counters of
+        authors (ids) with a single UPDATE."""
+        FoodgramUser.objects.filter(pk__in=[self.pk, *authors]).update(
+            following_count=F('following_count') + Case(
+                When(pk=self.pk, then=Value(delta * len(authors))),
+                default=Value(0)
+            ),
+            followers_count=F('followers_count') + Case(
+                When(pk__in=authors, then=Value(delta)), default=Value(0)
+            )
+        )